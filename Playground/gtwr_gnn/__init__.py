@@ -1,9 +1,17 @@
-from .kernels import build_spatiotemporal_kernel
-from .wls import solve_local_wls
-from .model import MathematicallyCorrectGNNWeightNet, topk_rows, symmetrize_rows
+from .kernels import build_spatiotemporal_kernel, haversine_matrix, KroneckerPrior, spacetime_knn, SpaceTimeIndex, cross_kernel
+from .wls import solve_local_wls, solve_local_rows, dense_to_neighbors, as_neighbors
+from .model import MathematicallyCorrectGNNWeightNet, topk_rows, topk_neighbors, symmetrize_rows, prior_neighbors
 from .train import train_model, finetune_transductive_with_future
 from .inference import (
     predict_new_fullgraph, predict_new_oos_transductive, predict_new_prior_only,
-    predict_new
+    predict_new, IncrementalScorer
 )
-from .data_utils import load_panel_xlsx, build_panel_arrays, split_train_val_test, year_rows
+from .data_utils import load_panel, load_panel_xlsx, build_panel_arrays, split_train_val_test, year_rows
+from .cache import PriorCache
+from .sampling import NeighborSampler, BatchLoader
+from .sweep import grid, random_space, time_folds, run_sweep
+from .simulation import simulate_replicate, run_simulation, summarize_replicates
+from .telemetry import StageTimer, EpochProfiler
+from .precision import DtypePolicy, get_policy, set_policy, dtype_policy
+from .artifacts import Artifact, save_artifact, load_artifact, save_checkpoint, load_checkpoint
+from .server import MicroBatcher, ServiceMetrics, make_server
@@ -0,0 +1,210 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+import scipy.sparse as sp
+import torch
+
+from .model import MathematicallyCorrectGNNWeightNet
+
+# -----------------------------------------------------------------------------
+# Versioned on-disk artifacts for trained models and training checkpoints
+#   <dir>/meta.json        format/version, model config, alpha/tau, kernel
+#                          hyperparameters, bandwidths, feature column order,
+#                          scorer settings, training progress
+#   <dir>/model.pt         state_dict
+#   <dir>/train_state.pt   optimizer state + best_state (checkpoints only)
+#   <dir>/<name>.npy       OLD design / coords / times and the optional CSR
+#                          prior; memory-mapped (copy-on-write) on load
+# A save is written to a temporary directory and swapped in with os.replace,
+# so a crash mid-save never leaves a half-written artifact behind.
+# -----------------------------------------------------------------------------
+FORMAT = "gtwr_gnn.artifact"
+VERSION = 1
+
+
+def model_config(model):
+    """Constructor arguments of a MathematicallyCorrectGNNWeightNet, read from its layer shapes."""
+    enc = model.encoder
+    return dict(d_in=enc[0].in_features, spa_hid=enc[0].out_features, emb=enc[2].out_features)
+
+
+def _json_default(o):
+    if isinstance(o, np.generic):
+        return o.item()
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    raise TypeError(f"{type(o).__name__} is not JSON serialisable")
+
+
+def _swap_in(tmp, path):
+    old = None
+    if os.path.exists(path):
+        old = tempfile.mkdtemp(prefix=".old-", dir=os.path.dirname(path))
+        os.replace(path, os.path.join(old, "a"))
+    os.replace(tmp, path)
+    if old is not None:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def save_artifact(
+    path, model, feature_cols=None, train_data=None, prior=None, kernel=None, bandwidths=None,
+    scorer=None, optimizer=None, state=None
+):
+    """
+    Write model and everything needed to score with it to the directory path.
+
+    train_data: dict with X, y, coords, times of the OLD (training) rows, as
+                IncrementalScorer takes them; bandwidths are estimated from
+                them when not given.
+    prior:      optional (scipy sparse or dense) prior, stored as CSR.
+    kernel:     prior hyperparameters (tau_s, tau_t, k_neighbors, prior_self_weight).
+    bandwidths: (hS, hT) of the OLD graph.
+    scorer:     IncrementalScorer settings (lambda_blend, wls_kind, cross_topk, ...).
+    optimizer, state: training checkpoint (see save_checkpoint).
+    """
+    path = os.path.abspath(path)
+    kernel = dict(kernel or {})
+    arrays = {}
+    if train_data is not None:
+        arrays.update(X_old=np.asarray(train_data["X"]), y_old=np.asarray(train_data["y"]),
+                      coords_old=np.asarray(train_data["coords"], dtype=np.float32),
+                      times_old=np.asarray(train_data["times"], dtype=float))
+        if bandwidths is None:
+            from .inference import _estimate_bandwidths
+            t = arrays["times_old"]
+            bandwidths = _estimate_bandwidths([arrays["coords_old"][t == u] for u in np.unique(t)], t,
+                                              kernel.get("tau_s", 1.0), kernel.get("tau_t", 1.0))
+    prior_shape = None
+    if prior is not None:
+        A = sp.csr_matrix(prior)
+        arrays.update(prior_data=A.data, prior_indices=A.indices, prior_indptr=A.indptr)
+        prior_shape = list(A.shape)
+
+    meta = dict(
+        format=FORMAT, version=VERSION, created=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        model=dict(cls=type(model).__name__, **model_config(model)),
+        dtype=str(next(model.parameters()).dtype).replace("torch.", ""),
+        alpha=float(model.alpha), tau=float(model.tau),
+        kernel=kernel, bandwidths=None if bandwidths is None else [float(b) for b in bandwidths],
+        feature_cols=None if feature_cols is None else list(feature_cols),
+        scorer=dict(scorer or {}), prior_shape=prior_shape, state=None, arrays=list(arrays)
+    )
+
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".tmp-", dir=parent)
+    try:
+        torch.save({k: v.detach().cpu() for k, v in model.state_dict().items()}, os.path.join(tmp, "model.pt"))
+        if optimizer is not None or state is not None:
+            state = dict(state or {})
+            torch.save(dict(optimizer=None if optimizer is None else optimizer.state_dict(),
+                            best_state=state.pop("best_state", None)), os.path.join(tmp, "train_state.pt"))
+            meta["state"] = state
+        for name, a in arrays.items():
+            np.save(os.path.join(tmp, f"{name}.npy"), a)
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=1, default=_json_default)
+        _swap_in(tmp, path)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return path
+
+
+def read_meta(path):
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    if meta.get("format") != FORMAT:
+        raise ValueError(f"{path} is not a gtwr_gnn artifact")
+    if meta["version"] > VERSION:
+        raise ValueError(f"{path} has artifact version {meta['version']}; this build reads up to {VERSION}")
+    return meta
+
+
+class Artifact:
+    """
+    A loaded artifact. model is ready for inference (eval mode); arrays are
+    memory-mapped, so opening is independent of the panel size.
+    """
+    def __init__(self, path, model, meta, arrays):
+        self.path, self.model, self.meta, self.arrays = path, model, meta, arrays
+
+    @property
+    def feature_cols(self):
+        return self.meta["feature_cols"]
+
+    @property
+    def bandwidths(self):
+        return None if self.meta["bandwidths"] is None else tuple(self.meta["bandwidths"])
+
+    @property
+    def kernel(self):
+        return self.meta["kernel"]
+
+    @property
+    def prior(self):
+        """Stored prior as a memory-backed CSR matrix, or None."""
+        if self.meta["prior_shape"] is None:
+            return None
+        a = self.arrays
+        return sp.csr_matrix((a["prior_data"], a["prior_indices"], a["prior_indptr"]),
+                             shape=tuple(self.meta["prior_shape"]), copy=False)
+
+    def scorer(self, device=None, **overrides):
+        """IncrementalScorer over the stored OLD rows, with the stored bandwidths and settings."""
+        from .inference import IncrementalScorer
+        if "X_old" not in self.arrays:
+            raise ValueError("artifact was saved without train_data")
+        a = self.arrays
+        kw = dict(tau_s=self.kernel.get("tau_s", 1.0), tau_t=self.kernel.get("tau_t", 1.0),
+                  bandwidths=self.bandwidths, **self.meta["scorer"])
+        kw.update(overrides)
+        return IncrementalScorer(self.model, a["X_old"], a["y_old"], a["coords_old"], a["times_old"],
+                                 device=device, **kw)
+
+
+def load_artifact(path, device=None, mmap=True):
+    """Open an artifact written by save_artifact / save_checkpoint."""
+    path = os.path.abspath(path)
+    meta = read_meta(path)
+    cfg = dict(meta["model"])
+    if cfg.pop("cls") != MathematicallyCorrectGNNWeightNet.__name__:
+        raise ValueError(f"Unsupported model class in {path}")
+    state = torch.load(os.path.join(path, "model.pt"), map_location=device or "cpu", mmap=mmap, weights_only=True)
+    model = MathematicallyCorrectGNNWeightNet(**cfg).to(device=device or "cpu", dtype=getattr(torch, meta["dtype"]))
+    model.load_state_dict(state)
+    model.eval()
+    arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="c" if mmap else None)
+              for name in meta["arrays"]}
+    return Artifact(path, model, meta, arrays)
+
+
+# ---------- training checkpoints ----------
+def save_checkpoint(path, model, optimizer, epoch, history, best_state=None, best_val=float("inf"), best_ep=0,
+                    **artifact_kwargs):
+    """Model + optimizer + early-stopping state after epoch; resume with train_model(resume_from=path)."""
+    return save_artifact(path, model, optimizer=optimizer, **artifact_kwargs,
+                         state=dict(epoch=int(epoch), history=history, best_val=float(best_val),
+                                    best_ep=int(best_ep), best_state=best_state))
+
+
+def load_checkpoint(path, model, optimizer=None, device=None):
+    """
+    Restore model (and optimizer) in place from a checkpoint. Returns the
+    training state: epoch, history, best_val, best_ep, best_state.
+    """
+    path = os.path.abspath(path)
+    meta = read_meta(path)
+    if meta["state"] is None:
+        raise ValueError(f"{path} is not a training checkpoint")
+    if model_config(model) != {k: v for k, v in meta["model"].items() if k != "cls"}:
+        raise ValueError(f"{path} was written for a model with config {meta['model']}")
+    device = device or next(model.parameters()).device
+    model.load_state_dict(torch.load(os.path.join(path, "model.pt"), map_location=device, weights_only=True))
+    extra = torch.load(os.path.join(path, "train_state.pt"), map_location="cpu", weights_only=True)
+    if optimizer is not None and extra["optimizer"] is not None:
+        optimizer.load_state_dict(extra["optimizer"])
+    return dict(meta["state"], best_state=extra["best_state"])
@@ -2,7 +2,7 @@
 import numpy as np
 from sklearn.linear_model import LinearRegression, HuberRegressor, Ridge, Lasso
 import torch
-from .wls import solve_local_wls
+from .wls import solve_local_wls, dense_to_neighbors
 
 def baseline_sklearn(name, X_train, y_train, X_all, **kwargs):
     name = name.lower()
@@ -20,6 +20,10 @@ def baseline_sklearn(name, X_train, y_train, X_all, **kwargs):
         return m.predict(X_all)
     raise ValueError(f"Unknown baseline: {name}")
 
-def gtwr_prior_baseline(X_t, y_t, A_prior, ridge_lambda=5.0):
-    y_hat = solve_local_wls(X_t, y_t, A_prior, kind='ridge', ridge=ridge_lambda, return_betas=False)
+def gtwr_prior_baseline(X_t, y_t, A_prior, ridge_lambda=5.0, rows=None):
+    # the kNN prior is mostly zeros: solve on its neighbour lists only
+    # rows: optional indices/mask (e.g. test rows); y_hat is returned for those only
+    if A_prior.layout == torch.strided:
+        A_prior = dense_to_neighbors(A_prior)
+    y_hat = solve_local_wls(X_t, y_t, A_prior, kind='ridge', ridge=ridge_lambda, return_betas=False, rows=rows)
     return y_hat
@@ -0,0 +1,177 @@
+import argparse
+import contextlib
+import copy
+import io
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import torch
+
+from .kernels import build_spatiotemporal_kernel
+from .wls import solve_local_wls
+from .model import MathematicallyCorrectGNNWeightNet
+from .train import train_model
+from .inference import predict_new_fullgraph, predict_new_oos_transductive, predict_new_prior_only
+from .telemetry import PeakRSS
+
+# -----------------------------------------------------------------------------
+# Benchmark suite: synthetic panels at fixed (N, T, p, k) scales, timings and
+# peak memory for each pipeline stage, JSON output for version-to-version
+# comparison.
+#   python -m gtwr_gnn.benchmarks --scales small medium --out bench.json
+#   python -m gtwr_gnn.benchmarks --compare old.json bench.json
+# -----------------------------------------------------------------------------
+SCALES = {
+    "small":  dict(N=50,  T=4, p=4, k=8),
+    "medium": dict(N=200, T=6, p=6, k=8),
+    "large":  dict(N=500, T=8, p=8, k=16),
+}
+CASES = ["kernel_build", "wls_ridge", "wls_huber", "forward", "train_epoch",
+         "predict_fullgraph", "predict_oos", "predict_prior_only"]
+
+
+def synthetic_panel(N, T, p, seed=0):
+    """Balanced panel over N Indonesian-range sites and T years with smoothly varying coefficients."""
+    rng = np.random.default_rng(seed)
+    lat, lon = rng.uniform(-8, 5, N), rng.uniform(95, 140, N)
+    beta = np.column_stack([np.sin(lat / 3 + j) + (lon - 117) / 20 for j in range(p)])
+    X = rng.normal(size=(T, N, p))
+    y = (X * beta).sum(axis=2) + 0.1 * rng.normal(size=(T, N))
+    df = pd.DataFrame({"lat": np.tile(lat, T), "lon": np.tile(lon, T), "year": np.repeat(2000 + np.arange(T), N),
+                       "y": y.ravel(), **{f"x{j}": X[:, :, j].ravel() for j in range(p)}})
+    return df, [f"x{j}" for j in range(p)]
+
+
+def _measure(fn, repeat=3, warmup=1):
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    # memory in a separate run so tracing does not distort the timings
+    tracemalloc.start()
+    with PeakRSS() as rss:
+        fn()
+    _, py_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return dict(time_min_s=min(times), time_median_s=statistics.median(times),
+                py_peak_mb=py_peak / 2**20, rss_peak_delta_mb=rss.delta / 2**20)
+
+
+def _cases(N, T, p, k, seed=0):
+    """Closures for each benchmark case on one synthetic panel."""
+    from .data_utils import build_panel_arrays, split_train_val_test
+    df, fc = synthetic_panel(N, T, p, seed)
+    P = build_panel_arrays(df, "year", "y", fc, "lat", "lon")
+    sp_ = split_train_val_test(P["times"], P["N_per_year"])
+    A = build_spatiotemporal_kernel(P["coords_blocks"], P["times"], k_neighbors=k, verbose=False)
+    torch.manual_seed(seed)
+    model = MathematicallyCorrectGNNWeightNet(p)
+    X_t, y_t = torch.as_tensor(P["X_all"]), torch.as_tensor(P["y_all"])
+    A_t = torch.as_tensor(np.asarray(A), dtype=torch.float32)
+    with torch.no_grad():
+        W, _ = model(X_t, A_t)
+
+    old = np.concatenate([sp_["train_rows"], sp_["val_rows"]])
+    X_o, y_o, c_o = P["X_all"][old], P["y_all"][old], P["coords_all"][old]
+    t_o = np.repeat(P["times"][:-1], N).astype(float)
+    new_df = df[df["year"] == P["times"][-1]]
+    pred_args = (X_o, y_o, c_o, t_o, new_df, fc, "year", "lat", "lon")
+
+    def _train_epoch():
+        # fresh copy per call: the predict cases must not see a trained / recast model
+        with contextlib.redirect_stdout(io.StringIO()):
+            train_model(copy.deepcopy(model), P["X_all"], P["y_all"], A, sp_["train_rows"], sp_["val_rows"],
+                        epochs=1, print_every=10**9, N_per_year=P["N_per_year"], times=P["times"])
+
+    def _no_grad(f):
+        def g():
+            with torch.no_grad():
+                f()
+        return g
+
+    return {
+        "kernel_build": lambda: build_spatiotemporal_kernel(P["coords_blocks"], P["times"], k_neighbors=k,
+                                                            verbose=False),
+        "wls_ridge": _no_grad(lambda: solve_local_wls(X_t, y_t, W, kind="ridge")),
+        "wls_huber": _no_grad(lambda: solve_local_wls(X_t, y_t, W, kind="huber")),
+        "forward": _no_grad(lambda: model(X_t, A_t)),
+        "train_epoch": _train_epoch,
+        "predict_fullgraph": lambda: predict_new_fullgraph(model, *pred_args, knn_k=k),
+        "predict_oos": lambda: predict_new_oos_transductive(model, *pred_args, knn_k=k, cross_topk=k),
+        "predict_prior_only": lambda: predict_new_prior_only(*pred_args, knn_k=k, cross_topk=k),
+    }
+
+
+def environment():
+    return dict(python=platform.python_version(), torch=torch.__version__, numpy=np.__version__,
+                platform=platform.platform(), threads=torch.get_num_threads())
+
+
+def run_benchmarks(scales=("small", "medium"), cases=None, repeat=3, out_json=None, seed=0):
+    """
+    Time and memory-profile every case at every scale. Returns the result
+    document (environment + one record per scale/case); written to out_json
+    if given. Scales are names from SCALES or dicts with N, T, p, k.
+    """
+    cases = list(cases or CASES)
+    records = []
+    for scale in scales:
+        dims = SCALES[scale] if isinstance(scale, str) else dict(scale)
+        name = scale if isinstance(scale, str) else "N{N}_T{T}_p{p}_k{k}".format(**dims)
+        fns = _cases(**dims, seed=seed)
+        for case in cases:
+            rec = dict(scale=name, case=case, **dims)
+            rec.update(_measure(fns[case], repeat=repeat))
+            records.append(rec)
+    doc = dict(environment=environment(), created=time.strftime("%Y-%m-%dT%H:%M:%S"), results=records)
+    if out_json is not None:
+        with open(out_json, "w") as f:
+            json.dump(doc, f, indent=2)
+    return doc
+
+
+def compare(baseline, current, metric="time_median_s", tolerance=0.25):
+    """
+    Side-by-side table of two result documents (dicts or JSON paths);
+    regression = current is more than (1 + tolerance) times the baseline.
+    """
+    def _load(d):
+        if isinstance(d, str):
+            with open(d) as f:
+                d = json.load(f)
+        return pd.DataFrame(d["results"]).set_index(["scale", "case"])[metric]
+    b, c = _load(baseline), _load(current)
+    out = pd.concat([b.rename("baseline"), c.rename("current")], axis=1).dropna()
+    out["ratio"] = out["current"] / out["baseline"]
+    out["regression"] = out["ratio"] > 1.0 + tolerance
+    return out.reset_index()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="gtwr_gnn benchmark suite")
+    ap.add_argument("--scales", nargs="+", default=["small", "medium"], choices=list(SCALES))
+    ap.add_argument("--cases", nargs="+", default=None, choices=CASES)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--out", default=None, help="write results JSON here")
+    ap.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), default=None,
+                    help="compare two results JSON files instead of running")
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    args = ap.parse_args(argv)
+    if args.compare:
+        table = compare(*args.compare, tolerance=args.tolerance)
+        print(table.to_string(index=False))
+        return int(table["regression"].any())
+    doc = run_benchmarks(args.scales, args.cases, args.repeat, args.out)
+    print(pd.DataFrame(doc["results"]).to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import scipy.sparse as sp
+
+
+class PriorCache:
+    """
+    Content-hashed on-disk cache for spatio-temporal priors and bandwidths.
+
+    Each entry is a directory of .npy arrays (memory-mapped on load) plus a
+    meta.json. Keys hash the coordinates, times and kernel parameters, so a
+    changed input never hits a stale entry. Total size is bounded by
+    max_bytes; the least recently used entries are evicted first.
+    """
+    VERSION = 1
+
+    def __init__(self, root, max_bytes=2 * 1024**3):
+        self.root = os.path.abspath(root)
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.root, exist_ok=True)
+
+    # ---------- keys ----------
+    @classmethod
+    def make_key(cls, *arrays, **params):
+        h = hashlib.sha256(f"v{cls.VERSION}".encode())
+        for a in arrays:
+            a = np.asarray(a)
+            if a.dtype.kind == "f":
+                a = a.astype(np.float64)   # float32/float64 copies of the same panel share a key
+            a = np.ascontiguousarray(a)
+            h.update(f"{a.dtype.str}{a.shape}".encode())
+            h.update(a.tobytes())
+        h.update(json.dumps(params, sort_keys=True, default=str).encode())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    # ---------- generic entries ----------
+    def load(self, key, mmap=True):
+        """Return (arrays, meta) for key, or None on a miss."""
+        path = self._path(key)
+        meta_path = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_path):
+            self.misses += 1
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None)
+                  for name in meta.pop("_arrays", [])}
+        os.utime(meta_path)            # mark as recently used
+        self.hits += 1
+        return arrays, meta
+
+    def save(self, key, arrays=None, **meta):
+        arrays = arrays or {}
+        tmp = tempfile.mkdtemp(prefix=".tmp-", dir=self.root)
+        for name, a in arrays.items():
+            np.save(os.path.join(tmp, f"{name}.npy"), np.asarray(a))
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump(dict(meta, _arrays=list(arrays)), f)
+        try:
+            os.replace(tmp, self._path(key))
+        except OSError:
+            # another writer got there first; its entry is equivalent
+            shutil.rmtree(tmp, ignore_errors=True)
+        self._evict()
+
+    def _entries(self):
+        out = []
+        for name in os.listdir(self.root):
+            path = self._path(name)
+            meta_path = os.path.join(path, "meta.json")
+            if name.startswith(".") or not os.path.exists(meta_path):
+                continue
+            size = sum(e.stat().st_size for e in os.scandir(path))
+            out.append((os.path.getmtime(meta_path), size, path))
+        return sorted(out)
+
+    def _evict(self):
+        entries = self._entries()
+        total = sum(s for _, s, _ in entries)
+        # always keep the most recent entry, even if it alone exceeds the budget
+        for _, size, path in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def size_bytes(self):
+        return sum(s for _, s, _ in self._entries())
+
+    def clear(self):
+        for _, _, path in self._entries():
+            shutil.rmtree(path, ignore_errors=True)
+
+    # ---------- sparse priors ----------
+    def load_prior(self, key):
+        """Return (csr_matrix, meta) backed by memory-mapped arrays, or None."""
+        hit = self.load(key)
+        if hit is None:
+            return None
+        arrays, meta = hit
+        A = sp.csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]),
+                          shape=tuple(meta["shape"]), copy=False)
+        return A, meta
+
+    def save_prior(self, key, A, **meta):
+        A = sp.csr_matrix(A)
+        self.save(key, dict(data=A.data, indices=A.indices, indptr=A.indptr),
+                  shape=list(A.shape), **meta)
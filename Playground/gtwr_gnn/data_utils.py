@@ -1,47 +1,109 @@
+import os
 import numpy as np
 import pandas as pd
 
-def load_panel_xlsx(path_xlsx, lat_col, lon_col, time_col, target_col, feature_cols):
-    df = pd.read_excel(path_xlsx)
-    df = df[[lat_col, lon_col, time_col, target_col] + list(feature_cols)].dropna().copy()
+# -----------------------------------------------------------------------------
+# Panel ingestion: csv / parquet / arrow (feather) / xlsx, only the needed
+# columns, float32 value columns. Optional snapshot (.npz, or .parquet with
+# pyarrow) lets repeat runs skip parsing; it is reused while it is newer than
+# the source file and was written for exactly the requested columns.
+# -----------------------------------------------------------------------------
+_READERS = {
+    ".csv": lambda p, cols, dt: pd.read_csv(p, usecols=cols, dtype=dt),
+    ".parquet": lambda p, cols, dt: pd.read_parquet(p, columns=cols),
+    ".arrow": lambda p, cols, dt: pd.read_feather(p, columns=cols),
+    ".feather": lambda p, cols, dt: pd.read_feather(p, columns=cols),
+    ".xlsx": lambda p, cols, dt: pd.read_excel(p, usecols=cols, dtype=dt),
+    ".xls": lambda p, cols, dt: pd.read_excel(p, usecols=cols, dtype=dt),
+}
+
+def _read_snapshot(path, cols):
+    # reuse only a snapshot of exactly these columns: rows were dropped for NaNs in all of them
+    if path.endswith(".npz"):
+        with np.load(path, allow_pickle=False) as z:
+            if "__columns__" not in z.files or z["__columns__"].tolist() != list(cols):
+                return None
+            # text columns were stored as fixed-width unicode; back to object like a fresh parse
+            return pd.DataFrame({c: z[c].astype(object) if z[c].dtype.kind == "U" else z[c] for c in cols})
+    df = pd.read_parquet(path)
+    return df if list(df.columns) == list(cols) else None
+
+def _write_snapshot(df, path):
+    if path.endswith(".npz"):
+        arrays = {c: df[c].to_numpy() for c in df.columns}
+        arrays = {c: np.asarray(a, dtype=str) if a.dtype.kind not in "biuf" else a for c, a in arrays.items()}
+        np.savez(path, __columns__=np.asarray(list(df.columns), dtype=str), **arrays)
+    else:
+        df.to_parquet(path, index=False)
+
+def load_panel(path, lat_col, lon_col, time_col, target_col, feature_cols, snapshot=None):
+    cols = [lat_col, lon_col, time_col, target_col] + list(feature_cols)
+    if snapshot is not None and os.path.exists(snapshot) and os.path.getmtime(snapshot) >= os.path.getmtime(path):
+        df = _read_snapshot(snapshot, cols)
+        if df is not None:
+            return df
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in _READERS:
+        raise ValueError(f"Unsupported panel format: {ext}")
+    dtypes = {c: np.float32 for c in cols if c != time_col}
+    df = _READERS[ext](path, cols, dtypes)[cols]
+    df = df.astype(dtypes).dropna().reset_index(drop=True)
+    if snapshot is not None:
+        _write_snapshot(df, snapshot)
     return df
 
-def build_panel_arrays(df, time_col, target_col, feature_cols, lat_col, lon_col, times_sorted=None):
+def load_panel_xlsx(path_xlsx, lat_col, lon_col, time_col, target_col, feature_cols, snapshot=None):
+    return load_panel(path_xlsx, lat_col, lon_col, time_col, target_col, feature_cols, snapshot=snapshot)
+
+def build_panel_arrays(df, time_col, target_col, feature_cols, lat_col, lon_col, times_sorted=None, balance=False):
+    """
+    Stack the panel period by period (sorted by time, lat, lon).
+    Periods may have different sizes: rows of period t are
+    period_ptr[t]:period_ptr[t+1] (CSR-style offsets). N_per_year is the
+    common size for a balanced panel, otherwise period_ptr itself; every
+    helper taking N_per_year accepts either. balance=True restores the old
+    behaviour of truncating each period to the smallest one.
+    """
     if times_sorted is None:
         times_sorted = np.sort(df[time_col].unique())
     df_sorted = df.sort_values([time_col, lat_col, lon_col]).reset_index(drop=True)
 
-    X_blocks, y_blocks, C_blocks = [], [], []
-    Ns = []
-    for t in times_sorted:
-        dtt = df_sorted[df_sorted[time_col] == t].reset_index(drop=True)
-        X_blocks.append(dtt[feature_cols].values.astype(np.float32))
-        y_blocks.append(dtt[target_col].values.astype(np.float32))
-        C_blocks.append(dtt[[lat_col, lon_col]].values.astype(np.float32))
-        Ns.append(len(dtt))
-    # balance panel to min N
-    if len(set(Ns)) != 1:
-        minN = min(Ns)
-        X_blocks = [x[:minN] for x in X_blocks]
-        y_blocks = [y[:minN] for y in y_blocks]
-        C_blocks = [c[:minN] for c in C_blocks]
-        N_per_year = minN
-    else:
-        N_per_year = Ns[0]
+    # one pass: period boundaries in the sorted frame, then slice the arrays
+    tv = df_sorted[time_col].to_numpy()
+    lo = np.searchsorted(tv, times_sorted, side="left")
+    hi = np.searchsorted(tv, times_sorted, side="right")
+    if balance:
+        hi = lo + (hi - lo).min()
+    # np.array copies: to_numpy may hand back read-only views of the frame
+    X = np.array(df_sorted[list(feature_cols)], dtype=np.float32)
+    y = np.array(df_sorted[target_col], dtype=np.float32)
+    C = np.array(df_sorted[[lat_col, lon_col]], dtype=np.float32)
+    if len(lo) and not (np.array_equal(lo[1:], hi[:-1]) and lo[0] == 0 and hi[-1] == len(tv)):
+        keep = np.concatenate([np.arange(a, b) for a, b in zip(lo, hi)])
+        X, y, C = X[keep], y[keep], C[keep]
+    Ns = hi - lo
+    period_ptr = np.concatenate([[0], np.cumsum(Ns)]).astype(np.int64)
+    C_blocks = [C[a:b] for a, b in zip(period_ptr[:-1], period_ptr[1:])]
+    N_per_year = int(Ns[0]) if len(set(Ns.tolist())) == 1 else period_ptr
+
+    return dict(X_all=X, y_all=y, coords_all=C, coords_blocks=C_blocks, times=times_sorted,
+                N_per_year=N_per_year, period_ptr=period_ptr)
+
+def period_ptr(times_sorted, N_per_year):
+    """CSR-style period offsets from a per-period size (int) or an existing period_ptr."""
+    if np.ndim(N_per_year) == 0:
+        return np.arange(len(times_sorted) + 1, dtype=np.int64) * int(N_per_year)
+    return np.asarray(N_per_year, dtype=np.int64)
 
-    X_all = np.vstack(X_blocks)
-    y_all = np.hstack(y_blocks)
-    C_all = np.vstack(C_blocks)
-    return dict(X_all=X_all, y_all=y_all, coords_all=C_all,
-                coords_blocks=C_blocks, times=times_sorted, N_per_year=N_per_year)
+def row_periods(times_sorted, N_per_year):
+    """Period index of every stacked row."""
+    ptr = period_ptr(times_sorted, N_per_year)
+    return np.repeat(np.arange(len(ptr) - 1), np.diff(ptr))
 
 def year_rows(times_sorted, N_per_year, target_year):
-    idx, cur = [], 0
-    for t in times_sorted:
-        if t == target_year:
-            idx.extend(range(cur, cur+N_per_year))
-        cur += N_per_year
-    return np.array(idx)
+    ptr = period_ptr(times_sorted, N_per_year)
+    idx = [np.arange(ptr[t], ptr[t+1]) for t, yr in enumerate(times_sorted) if yr == target_year]
+    return np.concatenate(idx) if idx else np.array([], dtype=int)
 
 def split_train_val_test(times_sorted, N_per_year, use_val=True):
     test_year = times_sorted[-1]
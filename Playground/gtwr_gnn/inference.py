@@ -2,56 +2,123 @@ import numpy as np
 import torch
 import torch.nn.functional as F
 
-from .kernels import build_spatiotemporal_kernel, haversine as _h
-from .wls import solve_local_wls
-from .model import topk_rows, symmetrize_rows
+from .kernels import (
+    build_spatiotemporal_kernel, cross_kernel, spacetime_knn, SpaceTimeIndex, haversine_matrix, haversine as _h
+)
+from .wls import solve_local_wls, solve_local_rows
+from .model import topk_rows, topk_neighbors, symmetrize_rows, prior_neighbors
+from .precision import get_policy, as_storage
+
+def _weighted_median(values, counts):
+    """np.median of `values` with each value repeated `counts` times, without expanding."""
+    order = np.argsort(values, kind="stable")
+    v, c = values[order], np.cumsum(counts[order])
+    n = c[-1]
+    lo = v[np.searchsorted(c, (n - 1) // 2, side="right")]
+    hi = v[np.searchsorted(c, n // 2, side="right")]
+    return 0.5 * (lo + hi)
+
+def _sample_pair_distances(coords_blocks, n_pairs, rng):
+    """Haversine distances of n_pairs unordered within-period pairs, drawn uniformly."""
+    Ns = np.array([len(C) for C in coords_blocks])
+    pairs = Ns * (Ns - 1) // 2
+    b = rng.choice(len(Ns), size=n_pairs, p=pairs / pairs.sum())
+    n = Ns[b]
+    i = rng.integers(0, n)
+    j = rng.integers(0, n - 1)
+    j = j + (j >= i)
+    C_all = np.vstack(coords_blocks).astype(np.float64)
+    off = np.concatenate([[0], np.cumsum(Ns)[:-1]])[b]
+    P, Q = C_all[off + i], C_all[off + j]
+    return _h(P[:, 0], P[:, 1], Q[:, 0], Q[:, 1])
 
 # -----------------------------------------------------------------------------
 # Helper: estimate global bandwidths from OLD graph (stable for OOS)
+#   - hS: median of within-period pairwise distances (upper triangle)
+#   - exact (default): one vectorised distance block per DISTINCT period
+#     layout, combined by a count-weighted median (== median over all pairs)
+#   - approx_eps: sample random pairs instead; by the DKW inequality the
+#     returned value is within approx_eps in quantile rank of the exact
+#     median with probability >= 1 - approx_delta
 # -----------------------------------------------------------------------------
-def _estimate_bandwidths(coords_blocks_old, times_old, tau_s=1.0, tau_t=1.0):
-    all_d = []
-    for C in coords_blocks_old:
-        n = len(C)
-        if n <= 1: 
-            continue
-        # pairwise upper triangle distances
-        for i in range(n):
-            lat1,lon1 = C[i]
-            for j in range(i+1, n):
-                lat2,lon2 = C[j]
-                all_d.append(_h(lat1,lon1,lat2,lon2))
-    hS = np.median(all_d) if len(all_d) else 100.0
+def _estimate_bandwidths(coords_blocks_old, times_old, tau_s=1.0, tau_t=1.0, cache=None,
+                         approx_eps=None, approx_delta=0.01, seed=0):
+    if cache is not None:
+        key = cache.make_key(np.vstack(coords_blocks_old), [len(C) for C in coords_blocks_old], times_old,
+                             kind="bandwidths", tau_s=tau_s, tau_t=tau_t,
+                             approx_eps=approx_eps, approx_delta=approx_delta, seed=seed)
+        hit = cache.load(key)
+        if hit is not None:
+            return hit[1]["hS"], hit[1]["hT"]
+    blocks = [np.asarray(C) for C in coords_blocks_old if len(C) > 1]
+    n_pairs = sum(len(C) * (len(C) - 1) // 2 for C in blocks)
+    n_sample = None
+    if approx_eps is not None:
+        n_sample = int(np.ceil(np.log(2.0 / approx_delta) / (2.0 * approx_eps ** 2)))
+    if n_pairs == 0:
+        hS = 100.0
+    elif n_sample is not None and n_sample < n_pairs:
+        hS = np.median(_sample_pair_distances(blocks, n_sample, np.random.default_rng(seed)))
+    else:
+        # identical period layouts (balanced panels) are computed once and weighted
+        uniq = {}
+        for C in blocks:
+            k = (C.shape, C.tobytes())
+            uniq[k] = (C, uniq[k][1] + 1) if k in uniq else (C, 1)
+        vals, cnts = [], []
+        for C, c in uniq.values():
+            iu = np.triu_indices(len(C), k=1)
+            vals.append(haversine_matrix(C)[iu])
+            cnts.append(np.full(len(iu[0]), c))
+        hS = _weighted_median(np.concatenate(vals), np.concatenate(cnts))
     hS = max(hS / max(tau_s, 1e-6), 1e-6)
 
     tgrid = np.sort(np.unique(times_old))
     Dt = np.abs(tgrid[:,None] - tgrid[None,:])
     hT = np.median(Dt[Dt>0]) if (Dt>0).any() else 1.0
     hT = max(hT / max(tau_t, 1e-6), 1e-6)
+    if cache is not None:
+        cache.save(key, hS=float(hS), hT=float(hT))
     return hS, hT
 
+# -----------------------------------------------------------------------------
+# Helper: row-normalised NEW→OLD prior block (shared by Modes B and C)
+#   - Vectorised haversine x temporal Gaussian over the whole block
+#   - cross_topk keeps each NEW row's top-k OLD neighbours (spatial index)
+# -----------------------------------------------------------------------------
+def _cross_prior(coords_new, times_new, coords_old, times_old, hS, hT, cross_topk=None, index=None):
+    n_old = len(coords_old)
+    k = min(cross_topk, max(1, n_old-1)) if (cross_topk is not None and cross_topk > 0) else None
+    A_cross = cross_kernel(coords_new, times_new, coords_old, times_old, hS, hT, topk=k, index=index)
+    return A_cross / (A_cross.sum(axis=1, keepdims=True) + 1e-12)
+
 # -----------------------------------------------------------------------------
 # Mode A — Semi-supervised style: FULL GRAPH forward (train + new) 
 #   - Rebuild prior on (OLD ∪ NEW)
 #   - Forward the trained GNN once to get learned W on the extended graph
 #   - Solve local-WLS and return NEW slice
 #   - This mimics how you produced TEST metrics (transductive).
+#   - sparse_attention: forward on the prior's neighbour lists
+#     (model.forward_sparse); no (NT, NT) prior or W is formed
 # -----------------------------------------------------------------------------
 def predict_new_fullgraph(
     model, X_train, y_train, coords_train, times_train,
     new_df, feature_cols, time_col, lat_col, lon_col,
     tau_s=1.0, tau_t=1.0, knn_k=8, prior_self_weight=1.0,
     wls_kind="ridge", ridge_lambda=5.0, huber_delta=1.0, huber_iters=3,
-    graph_topk=None, graph_symmetrize=False, device=None
+    graph_topk=None, graph_symmetrize=False, device=None, cache=None, sparse_attention=False
 ):
+    if sparse_attention and graph_symmetrize:
+        raise ValueError("graph_symmetrize needs dense weights; it is not available with sparse_attention")
     device = device or (next(model.parameters()).device)
+    dtype = next(model.parameters()).dtype        # the model's own dtype, whatever the active policy
 
     # ---- Stack OLD + NEW ----
-    X_new = new_df[feature_cols].values.astype(np.float32)
+    X_new = new_df[feature_cols].to_numpy()
     coords_new = new_df[[lat_col, lon_col]].values.astype(np.float32)
     times_new = new_df[time_col].values.astype(float)
 
-    X_comb = np.vstack([X_train, X_new]).astype(np.float32)
+    X_comb = np.vstack([X_train, X_new])
     coords_comb = np.vstack([coords_train, coords_new]).astype(np.float32)
     times_comb = np.concatenate([times_train, times_new]).astype(float)
 
@@ -61,27 +128,34 @@ def predict_new_fullgraph(
     A_prior_ext_np = build_spatiotemporal_kernel(
         coords_blocks=coords_blocks, times=unique_times,
         tau_s=tau_s, tau_t=tau_t, k_neighbors=knn_k,
-        prior_self_weight=prior_self_weight, verbose=False
+        prior_self_weight=prior_self_weight, verbose=False, return_sparse=True, cache=cache
     )
 
     # ---- Forward once on extended graph ----
-    X_comb_t = torch.tensor(X_comb, dtype=torch.float32, device=device)
-    A_prior_ext = torch.tensor(A_prior_ext_np, dtype=torch.float32, device=device)
+    X_comb_t = as_storage(X_comb, device, dtype)
     n_old, n_new = len(X_train), len(X_new)
 
     with torch.no_grad():
-        W_learned, _ = model(X_comb_t, A_prior_ext)
-        if graph_topk is not None:
-            W_learned = topk_rows(W_learned, graph_topk)
+        if sparse_attention:
+            idx, a = prior_neighbors(A_prior_ext_np, device=device)
+            W_learned, _ = model.forward_sparse(X_comb_t, idx, a.to(dtype))
+            if graph_topk is not None:
+                W_learned = topk_neighbors(W_learned, graph_topk)
+        else:
+            W_learned, _ = model(X_comb_t, as_storage(A_prior_ext_np, device, dtype))
+            if graph_topk is not None:
+                W_learned = topk_rows(W_learned, graph_topk)
         if graph_symmetrize:
             W_learned = symmetrize_rows(W_learned)
+        # only the NEW rows' local systems are needed
         y_hat = solve_local_wls(
             X_comb_t,
-            torch.tensor(np.concatenate([y_train, np.zeros(n_new, np.float32)]), device=device),
+            as_storage(np.concatenate([y_train, np.zeros(n_new)]), device, dtype),
             W_learned, kind=wls_kind, ridge=ridge_lambda,
-            huber_delta=huber_delta, huber_iters=huber_iters, return_betas=False
+            huber_delta=huber_delta, huber_iters=huber_iters, return_betas=False,
+            rows=torch.arange(n_old, n_old + n_new, device=device)
         )
-    return y_hat[n_old:].cpu().numpy()
+    return y_hat.cpu().numpy()
 
 # Backward-compatible alias
 predict_new = predict_new_fullgraph
@@ -100,101 +174,129 @@ def predict_new_oos_transductive(
     lambda_blend=0.8,
     wls_kind="ridge", ridge_lambda=5.0, huber_delta=1.0, huber_iters=3,
     graph_topk=None, graph_symmetrize=False, device=None,
-    cross_topk=None, new_self_weight=0.0
+    cross_topk=None, new_self_weight=0.0, cache=None, bandwidth_eps=None
 ):
-    device = device or (next(model.parameters()).device)
-
-    # ---- Extract ----
-    X_new = new_df[feature_cols].values.astype(np.float32)
-    coords_new = new_df[[lat_col, lon_col]].values.astype(np.float32)
-    times_new = new_df[time_col].values.astype(float)
-    n_old, n_new = len(X_train), len(X_new)
-
-    # ---- OLD-only prior & weights (freeze these rows) ----
-    unique_times_old = np.sort(np.unique(times_train))
-    coords_blocks_old = [coords_train[times_train == t] for t in unique_times_old]
-    A_prior_old_np = build_spatiotemporal_kernel(
-        coords_blocks=coords_blocks_old, times=unique_times_old,
-        tau_s=tau_s, tau_t=tau_t, k_neighbors=knn_k,
-        prior_self_weight=prior_self_weight, verbose=False
+    # OLD rows are frozen and never enter a NEW row's local system, so the OLD
+    # prior/graph (knn_k, prior_self_weight, graph_topk, graph_symmetrize) does
+    # not affect NEW predictions and is not rebuilt; only NEW rows are solved.
+    scorer = IncrementalScorer(
+        model, X_train, y_train, coords_train, times_train,
+        tau_s=tau_s, tau_t=tau_t, lambda_blend=lambda_blend,
+        wls_kind=wls_kind, ridge_lambda=ridge_lambda, huber_delta=huber_delta, huber_iters=huber_iters,
+        cross_topk=cross_topk, new_self_weight=new_self_weight, edge_restricted=False,
+        device=device, cache=cache, bandwidth_eps=bandwidth_eps
     )
-    A_prior_old = torch.tensor(A_prior_old_np, dtype=torch.float32, device=device)
-    X_old_t = torch.tensor(X_train, dtype=torch.float32, device=device)
-
-    with torch.no_grad():
-        W_old, H_old = model(X_old_t, A_prior_old)
-        if graph_topk is not None:
-            W_old = topk_rows(W_old, graph_topk)
-        if graph_symmetrize:
-            W_old = symmetrize_rows(W_old)
-
-    # ---- Bandwidths from OLD (stable) ----
-    hS, hT = _estimate_bandwidths(coords_blocks_old, times_train, tau_s, tau_t)
-
-    # ---- Prior cross NEW→OLD ----
-    A_cross = np.zeros((n_new, n_old), dtype=np.float32)
-    for i in range(n_new):
-        lat_i, lon_i, ti = coords_new[i,0], coords_new[i,1], times_new[i]
-        for j in range(n_old):
-            lat_j, lon_j, tj = coords_train[j,0], coords_train[j,1], times_train[j]
-            d_spa = _h(lat_i, lon_i, lat_j, lon_j)
-            d_tmp = abs(ti - tj)
-            A_cross[i, j] = np.exp(-0.5 * (d_spa/hS)**2) * np.exp(-0.5 * (d_tmp/hT)**2)
+    return scorer.score_df(new_df, feature_cols, time_col, lat_col, lon_col)
 
-    # sparsify cross block if requested
-    if cross_topk is not None and cross_topk > 0:
-        k = min(cross_topk, max(1, A_cross.shape[1]-1))
-        idx = np.argpartition(-A_cross, kth=k-1, axis=1)[:, :k]
-        rows = np.arange(n_new)[:, None]
-        mask = np.zeros_like(A_cross)
-        mask[rows, idx] = 1.0
-        A_cross = A_cross * mask
-
-    # normalize
-    A_cross = A_cross / (A_cross.sum(axis=1, keepdims=True) + 1e-12)
-
-    # ---- Blend prior cross with encoder cosine (as in training) ----
-    with torch.no_grad():
-        H_new = model.encoder(torch.tensor(X_new, dtype=torch.float32, device=device))
-        H_old_n = F.normalize(H_old, p=2, dim=1)
-        H_new_n = F.normalize(H_new, p=2, dim=1)
-        S = H_new_n @ H_old_n.t()            # cosine [-1,1]
-        logits = S / model.tau               # temperature scaling
-        log_prior_cross = torch.log(torch.tensor(A_cross, device=device) + 1e-12)
+# -----------------------------------------------------------------------------
+# Incremental Mode B scorer: fit once on OLD, score batches of NEW rows
+#   - Cached: OLD encoder embeddings (normalised), bandwidths, OLD design,
+#     per-period BallTrees for cross_topk
+#   - Per batch: NEW→OLD weights + the NEW rows' local systems only
+#   - edge_restricted (default when cross_topk is set): the learned blend is
+#     only formed on each NEW row's top-k prior neighbours, as in
+#     forward_sparse, so a batch costs O(n_new * k) instead of O(n_new * n_old).
+#     edge_restricted=False reproduces predict_new_oos_transductive exactly.
+#   - bandwidths=(hS, hT) skips the estimate (e.g. from a saved artifact;
+#     see artifacts.Artifact.scorer)
+# -----------------------------------------------------------------------------
+class IncrementalScorer:
+    def __init__(
+        self, model, X_train, y_train, coords_train, times_train,
+        tau_s=1.0, tau_t=1.0, lambda_blend=0.8,
+        wls_kind="ridge", ridge_lambda=5.0, huber_delta=1.0, huber_iters=3,
+        cross_topk=None, new_self_weight=0.0, edge_restricted=None,
+        device=None, cache=None, bandwidth_eps=None, bandwidths=None
+    ):
+        self.model = model
+        self.device = device or (next(model.parameters()).device)
+        self.dtype = next(model.parameters()).dtype     # inputs follow the model, not the active policy
+        self.lambda_blend = lambda_blend
+        self.wls_kind, self.ridge_lambda = wls_kind, ridge_lambda
+        self.huber_delta, self.huber_iters = huber_delta, huber_iters
+        self.cross_topk = cross_topk if (cross_topk is not None and cross_topk > 0) else None
+        self.new_self_weight = float(new_self_weight or 0.0)
+        self.edge_restricted = (self.cross_topk is not None) if edge_restricted is None else edge_restricted
+        if self.edge_restricted and self.cross_topk is None:
+            raise ValueError("edge_restricted scoring needs cross_topk")
+
+        self.coords_old = np.asarray(coords_train, dtype=np.float32)
+        self.times_old = np.asarray(times_train, dtype=float)
+        unique_times_old = np.sort(np.unique(self.times_old))
+        coords_blocks_old = [self.coords_old[self.times_old == t] for t in unique_times_old]
+        self.hS, self.hT = bandwidths if bandwidths is not None else _estimate_bandwidths(
+            coords_blocks_old, self.times_old, tau_s, tau_t, cache=cache, approx_eps=bandwidth_eps)
+        self.index = SpaceTimeIndex(self.coords_old, self.times_old) if self.cross_topk is not None else None
+
+        self.X_old = as_storage(np.asarray(X_train), self.device, self.dtype)
+        self.y_old = as_storage(np.asarray(y_train), self.device, self.dtype)
+        self.n_old = len(self.X_old)
+        with torch.no_grad():
+            self.H_old_n = self._embed(self.X_old)
+
+    def _embed(self, X):
+        with get_policy().encoder_autocast(X.device):
+            return F.normalize(self.model.encoder(X), p=2, dim=1).to(X.dtype)
+
+    def _new_to_old(self, H_new_n, coords_new, times_new):
+        """Blended NEW→OLD weights: dense (n_new, n_old) or (idx, w) neighbour lists."""
+        model, lam = self.model, self.lambda_blend
         alpha = model.alpha
-        log_blend = alpha * log_prior_cross + (1 - alpha) * logits
-        W_new2old_gnn = F.softmax(log_blend, dim=1)  # rows sum to 1
-
-        if (lambda_blend is not None) and (0.0 <= lambda_blend <= 1.0):
-            W_new2old = lambda_blend * W_new2old_gnn + (1 - lambda_blend) * torch.tensor(A_cross, device=device)
-        else:
-            W_new2old = W_new2old_gnn
-
-    # ---- NEW→NEW block ----
-    if new_self_weight and new_self_weight > 0:
-        W_new2new = torch.eye(n_new, device=device) * float(new_self_weight)
-    else:
-        W_new2new = torch.zeros((n_new, n_new), device=device)
-
-    # ---- Assemble W_full ----
-    W_full = torch.zeros((n_old + n_new, n_old + n_new), device=device)
-    W_full[:n_old, :n_old] = W_old                    # frozen OLD rows
-    W_new_row = torch.cat([W_new2old, W_new2new], 1)  # only NEW rows depend on NEW
-    W_new_row = W_new_row / (W_new_row.sum(dim=1, keepdim=True) + 1e-12)
-    W_full[n_old:, :] = W_new_row
-
-    # ---- Solve local WLS (only NEW preds returned) ----
-    X_comb = np.vstack([X_train, X_new]).astype(np.float32)
-    X_comb_t = torch.tensor(X_comb, dtype=torch.float32, device=device)
-    y_stub = np.concatenate([y_train, np.zeros(n_new, dtype=np.float32)])
-    y_stub_t = torch.tensor(y_stub, dtype=torch.float32, device=device)
-
-    with torch.no_grad():
-        y_hat = solve_local_wls(
-            X_comb_t, y_stub_t, W_full, kind=wls_kind, ridge=ridge_lambda,
-            huber_delta=huber_delta, huber_iters=huber_iters, return_betas=False
-        )
-    return y_hat[n_old:].cpu().numpy()
+        if self.edge_restricted:
+            k = min(self.cross_topk, max(1, self.n_old-1))
+            A = spacetime_knn(coords_new, times_new, self.coords_old, self.times_old,
+                              self.hS, self.hT, k, index=self.index)
+            idx, a = prior_neighbors(A, device=self.device)
+            a = a.to(self.dtype)
+            a = a / (a.sum(dim=1, keepdim=True) + 1e-12)
+            logits = (H_new_n.unsqueeze(1) * self.H_old_n[idx]).sum(dim=2) / model.tau
+            log_blend = alpha * torch.log(a + 1e-12) + (1 - alpha) * logits
+            g = F.softmax(log_blend.masked_fill(a <= 0, float("-inf")), dim=1)
+            w = lam * g + (1 - lam) * a if (lam is not None) and (0.0 <= lam <= 1.0) else g
+            return idx, w
+        A_cross = as_storage(_cross_prior(coords_new, times_new, self.coords_old, self.times_old,
+                                          self.hS, self.hT, self.cross_topk, index=self.index),
+                             self.device, self.dtype)
+        logits = (H_new_n @ self.H_old_n.t()) / model.tau       # cosine [-1,1], temperature scaled
+        log_blend = alpha * torch.log(A_cross + 1e-12) + (1 - alpha) * logits
+        W_new2old_gnn = F.softmax(log_blend, dim=1)               # rows sum to 1
+        if (lam is not None) and (0.0 <= lam <= 1.0):
+            return lam * W_new2old_gnn + (1 - lam) * A_cross
+        return W_new2old_gnn
+
+    def score(self, X_new, coords_new, times_new):
+        X_new_t = as_storage(np.asarray(X_new), self.device, self.dtype)
+        coords_new = np.asarray(coords_new, dtype=np.float32)
+        times_new = np.asarray(times_new, dtype=float)
+        n_new = len(X_new_t)
+        # design = OLD rows + this batch's NEW rows (labels stubbed to 0)
+        X_design = torch.cat([self.X_old, X_new_t], 0)
+        y_design = torch.cat([self.y_old, torch.zeros(n_new, device=self.device, dtype=self.X_old.dtype)], 0)
+        self_col = self.n_old + torch.arange(n_new, device=self.device)
+
+        with torch.no_grad():
+            H_new_n = self._embed(X_new_t)
+            W = self._new_to_old(H_new_n, coords_new, times_new)
+            # NEW→NEW: only each row's own self weight (default 0, avoids leakage)
+            if isinstance(W, tuple):
+                idx, w = W
+                idx = torch.cat([idx, self_col.unsqueeze(1)], 1)
+                w = torch.cat([w, torch.full((n_new, 1), self.new_self_weight, device=self.device, dtype=w.dtype)], 1)
+                W_rows = (idx, w / (w.sum(dim=1, keepdim=True) + 1e-12))
+            else:
+                W_new2new = torch.eye(n_new, device=self.device, dtype=W.dtype) * self.new_self_weight
+                W_rows = torch.cat([W, W_new2new], 1)
+                W_rows = W_rows / (W_rows.sum(dim=1, keepdim=True) + 1e-12)
+            y_hat = solve_local_rows(
+                X_design, y_design, W_rows, X_new_t, kind=self.wls_kind, ridge=self.ridge_lambda,
+                huber_delta=self.huber_delta, huber_iters=self.huber_iters, return_betas=False
+            )
+        return y_hat.cpu().numpy()
+
+    def score_df(self, new_df, feature_cols, time_col, lat_col, lon_col):
+        return self.score(new_df[feature_cols].to_numpy(),
+                          new_df[[lat_col, lon_col]].values.astype(np.float32),
+                          new_df[time_col].values.astype(float))
 
 # -----------------------------------------------------------------------------
 # Mode C — Prior-only OOS (for sanity checks / ablations)
@@ -204,12 +306,12 @@ def predict_new_prior_only(
     new_df, feature_cols, time_col, lat_col, lon_col,
     tau_s=1.0, tau_t=1.0, knn_k=8,
     wls_kind="ridge", ridge_lambda=5.0, huber_delta=1.0, huber_iters=3,
-    cross_topk=None, new_self_weight=0.0, device=None
+    cross_topk=None, new_self_weight=0.0, device=None, cache=None, bandwidth_eps=None
 ):
     """OOS using ONLY prior distances (no GNN), with 0 self-weight for NEW."""
     device = device or torch.device("cpu")
 
-    X_new = new_df[feature_cols].values.astype(np.float32)
+    X_new = new_df[feature_cols].to_numpy()
     coords_new = new_df[[lat_col, lon_col]].values.astype(np.float32)
     times_new = new_df[time_col].values.astype(float)
 
@@ -218,27 +320,11 @@ def predict_new_prior_only(
     # bandwidths from OLD only
     unique_times_old = np.sort(np.unique(times_train))
     coords_blocks_old = [coords_train[times_train == t] for t in unique_times_old]
-    hS, hT = _estimate_bandwidths(coords_blocks_old, times_train, tau_s, tau_t)
+    hS, hT = _estimate_bandwidths(coords_blocks_old, times_train, tau_s, tau_t, cache=cache,
+                                  approx_eps=bandwidth_eps)
 
     # cross NEW→OLD prior
-    A_cross = np.zeros((n_new, n_old), dtype=np.float32)
-    for i in range(n_new):
-        lat_i, lon_i, ti = coords_new[i,0], coords_new[i,1], times_new[i]
-        for j in range(n_old):
-            lat_j, lon_j, tj = coords_train[j,0], coords_train[j,1], times_train[j]
-            d_spa = _h(lat_i, lon_i, lat_j, lon_j)
-            d_tmp = abs(ti - tj)
-            A_cross[i, j] = np.exp(-0.5 * (d_spa/hS)**2) * np.exp(-0.5 * (d_tmp/hT)**2)
-
-    if cross_topk is not None and cross_topk > 0:
-        k = min(cross_topk, max(1, A_cross.shape[1]-1))
-        idx = np.argpartition(-A_cross, kth=k-1, axis=1)[:, :k]
-        rows = np.arange(n_new)[:, None]
-        mask = np.zeros_like(A_cross)
-        mask[rows, idx] = 1.0
-        A_cross = A_cross * mask
-
-    A_cross = A_cross / (A_cross.sum(axis=1, keepdims=True) + 1e-12)
+    A_cross = _cross_prior(coords_new, times_new, coords_train, times_train, hS, hT, cross_topk)
 
     # NEW→NEW self weight (default 0 to avoid leakage)
     if new_self_weight and new_self_weight > 0:
@@ -246,21 +332,17 @@ def predict_new_prior_only(
     else:
         W_new2new = torch.zeros((n_new, n_new))
 
-    W_full = torch.zeros((n_old + n_new, n_old + n_new), dtype=torch.float32, device=device)
-    # Old rows identity (not used for NEW predictions)
-    W_full[:n_old, :n_old] = torch.eye(n_old, device=device)
-    W_full[n_old:, :n_old] = torch.tensor(A_cross, dtype=torch.float32, device=device)
-    W_full[n_old:, n_old:] = W_new2new.to(device)
-    W_full[n_old:, :] = W_full[n_old:, :] / (W_full[n_old:, :].sum(dim=1, keepdim=True) + 1e-12)
+    # only NEW rows are solved, so only their weight rows are built (OLD rows never enter)
+    W_new = torch.cat([as_storage(A_cross, device), W_new2new.to(device=device, dtype=get_policy().storage)], 1)
+    W_new = W_new / (W_new.sum(dim=1, keepdim=True) + 1e-12)
 
-    X_comb = np.vstack([X_train, X_new]).astype(np.float32)
-    X_comb_t = torch.tensor(X_comb, dtype=torch.float32, device=device)
-    y_stub = np.concatenate([y_train, np.zeros(n_new, dtype=np.float32)])
-    y_stub_t = torch.tensor(y_stub, dtype=torch.float32, device=device)
+    X_comb = np.vstack([X_train, X_new])
+    X_comb_t = as_storage(X_comb, device)
+    y_stub_t = as_storage(np.concatenate([y_train, np.zeros(n_new)]), device)
 
     with torch.no_grad():
-        y_hat = solve_local_wls(
-            X_comb_t, y_stub_t, W_full, kind=wls_kind, ridge=ridge_lambda, 
+        y_hat = solve_local_rows(
+            X_comb_t, y_stub_t, W_new, X_comb_t[n_old:], kind=wls_kind, ridge=ridge_lambda,
             huber_delta=huber_delta, huber_iters=huber_iters, return_betas=False
         )
-    return y_hat[n_old:].cpu().numpy()
+    return y_hat.cpu().numpy()
@@ -1,6 +1,8 @@
 
-import math
 import numpy as np
+import scipy.sparse as sp
+from sklearn.neighbors import BallTree
+from .precision import get_policy
 
 def haversine(lat1, lon1, lat2, lon2):
     R = 6371.0
@@ -9,16 +11,35 @@ def haversine(lat1, lon1, lat2, lon2):
     a = np.sin(dlat/2)**2 + np.cos(lat1)*np.cos(lat2)*np.sin(dlon/2)**2
     return 2*R*np.arcsin(np.sqrt(a))
 
-def _pairwise_block(C1, C2):
+def haversine_matrix(C1, C2=None, dtype=np.float64, max_bytes=2**27):
+    """
+    Great-circle distances (km) between every row of C1 and C2, both (n, 2)
+    arrays of [lat, lon] in degrees. Broadcast in NumPy; row blocks are tiled
+    so that each temporary stays under ~max_bytes. dtype=np.float32 halves
+    memory at the cost of metre-level rounding.
+    """
+    R = 6371.0
+    C1 = np.radians(np.asarray(C1, dtype=dtype))
+    C2 = C1 if C2 is None else np.radians(np.asarray(C2, dtype=dtype))
     n1, n2 = len(C1), len(C2)
-    D = np.zeros((n1, n2), dtype=np.float64)
-    for i in range(n1):
-        lat1, lon1 = C1[i]
-        for j in range(n2):
-            lat2, lon2 = C2[j]
-            D[i, j] = haversine(lat1, lon1, lat2, lon2)
+    D = np.empty((n1, n2), dtype=dtype)
+    if n1 == 0 or n2 == 0:
+        return D
+    lat2, lon2 = C2[:, 0][None, :], C2[:, 1][None, :]
+    cos2 = np.cos(lat2)
+    # ~3 live (rows, n2) temporaries per tile
+    step = max(1, int(max_bytes // (3 * n2 * np.dtype(dtype).itemsize)))
+    for s in range(0, n1, step):
+        lat1, lon1 = C1[s:s+step, 0][:, None], C1[s:s+step, 1][:, None]
+        a = np.sin((lat2 - lat1) / 2) ** 2
+        a += np.cos(lat1) * cos2 * np.sin((lon2 - lon1) / 2) ** 2
+        np.clip(a, 0.0, 1.0, out=a)
+        D[s:s+step] = (2 * R) * np.arcsin(np.sqrt(a))
     return D
 
+def _pairwise_block(C1, C2, dtype=np.float64):
+    return haversine_matrix(C1, C2, dtype=dtype)
+
 def _check_consistent(coords_blocks, tol=1e-6):
     base = coords_blocks[0]
     for b in coords_blocks[1:]:
@@ -41,21 +62,205 @@ def _sparsify_knn(W, k, self_w=1.0):
     rs = W_out.sum(axis=1, keepdims=True)
     return W_out / np.where(rs>0, rs, 1.0)
 
+def _csr_row_normalize(A):
+    rs = np.asarray(A.sum(axis=1)).ravel()
+    return sp.diags(1.0 / np.where(rs>0, rs, 1.0)) @ A
+
+class KroneckerPrior:
+    """
+    W = kron(K_T, K_S) kept in factored form: row (t*N + i) is K_T[t] (x) K_S[i].
+    Memory is O(T^2 + N^2) instead of O((N*T)^2); the dense matrix is never formed.
+    """
+    def __init__(self, K_T, K_S):
+        self.K_T = np.asarray(K_T, dtype=np.float64)
+        self.K_S = np.asarray(K_S, dtype=np.float64)
+        self.T, self.N = self.K_T.shape[0], self.K_S.shape[0]
+        self.shape = (self.T * self.N, self.T * self.N)
+
+    def row_slice(self, rows):
+        """Dense rows of W, shape (len(rows), N*T)."""
+        rows = np.atleast_1d(np.asarray(rows))
+        t, i = np.divmod(rows, self.N)
+        return (self.K_T[t][:, :, None] * self.K_S[i][:, None, :]).reshape(len(rows), -1)
+
+    def matvec(self, v):
+        """W @ v via (K_T V K_S^T), with V = v reshaped to (T, N)."""
+        V = np.asarray(v).reshape(self.T, self.N)
+        return (self.K_T @ V @ self.K_S.T).reshape(-1)
+
+    def knn(self, k, self_w=1.0):
+        """
+        Same result as _sparsify_knn(kron(K_T, K_S), k, self_w), as CSR.
+        Since both factors are nonnegative, the top-k of K_T[t] (x) K_S[i]
+        (self excluded) lies within top-(k+1)(K_T[t]) x top-(k+1)(K_S[i]).
+        """
+        T, N = self.T, self.N
+        n = T * N
+        if n <= 1:
+            return sp.csr_matrix(np.eye(n) * self_w)
+        k_eff = min(k, max(1, n-1))
+        kt, ks = min(k_eff+1, T), min(k_eff+1, N)
+        ct = np.argpartition(-self.K_T, kth=kt-1, axis=1)[:, :kt]      # (T, kt)
+        cs = np.argpartition(-self.K_S, kth=ks-1, axis=1)[:, :ks]      # (N, ks)
+        vs = np.take_along_axis(self.K_S, cs, axis=1)
+        ar = np.arange(N)
+        indptr = np.arange(n+1) * (k_eff+1)
+        indices = np.empty(n * (k_eff+1), dtype=np.int64)
+        data = np.empty(n * (k_eff+1), dtype=np.float64)
+        for t in range(T):
+            vt = self.K_T[t, ct[t]]                                     # (kt,)
+            vals = (vt[None, :, None] * vs[:, None, :]).reshape(N, -1)  # (N, kt*ks)
+            cols = (ct[t][None, :, None] * N + cs[:, None, :]).reshape(N, -1)
+            rows = t * N + ar
+            vals = np.where(cols == rows[:, None], -np.inf, vals)
+            sel = np.argpartition(-vals, kth=k_eff-1, axis=1)[:, :k_eff]
+            blk = slice(t * N * (k_eff+1), (t+1) * N * (k_eff+1))
+            indices[blk] = np.hstack([np.take_along_axis(cols, sel, axis=1), rows[:, None]]).ravel()
+            data[blk] = np.hstack([np.take_along_axis(vals, sel, axis=1),
+                                   np.full((N, 1), float(self_w))]).ravel()
+        A = sp.csr_matrix((data, indices, indptr), shape=self.shape)
+        A.sort_indices()
+        return _csr_row_normalize(A).tocsr()
+
+    def toarray(self):
+        return np.kron(self.K_T, self.K_S)
+
+def _period_groups(times):
+    """Unique periods and the row indices of each, in order of appearance within a period."""
+    times = np.asarray(times, dtype=float)
+    order = np.argsort(times, kind="stable")
+    ut, starts = np.unique(times[order], return_index=True)
+    return ut, np.split(order, starts[1:])
+
+class SpaceTimeIndex:
+    """
+    Reference panel (coords_r, times_r) indexed by one haversine BallTree per
+    period, built once and reused across queries (see spacetime_knn).
+    """
+    def __init__(self, coords_r, times_r):
+        self.coords = np.asarray(coords_r, dtype=float)
+        self.n = len(self.coords)
+        self.times, self.groups = _period_groups(times_r)
+        self.trees = [BallTree(np.radians(self.coords[g]), metric="haversine") for g in self.groups]
+
+    def query(self, coords_q, times_q, hS, hT, k, exclude_self=False, site_weight=None):
+        R = 6371.0
+        coords_q = np.asarray(coords_q, dtype=float)
+        rt, r_groups, trees = self.times, self.groups, self.trees
+        qt, q_groups = _period_groups(times_q)
+        bound = max(1.0, site_weight or 0.0)
+        extra = 1 + int(exclude_self) + int(site_weight is not None)
+
+        rows_out, cols_out, vals_out = [], [], []
+        for tq, gq in zip(qt, q_groups):
+            Q = np.radians(coords_q[gq])
+            pos_q = np.arange(len(gq))
+            Kt = np.exp(-0.5 * ((np.abs(tq - rt) / hT) ** 2))
+            cand_v, cand_c = [], []
+            kth = None
+            for s in np.argsort(-Kt, kind="stable"):
+                if kth is not None and Kt[s] * bound < kth.min():
+                    break
+                kq = min(k + extra, len(r_groups[s]))
+                dist, ind = trees[s].query(Q, k=kq)
+                vals = Kt[s] * np.exp(-0.5 * ((dist * R / hS) ** 2))
+                if site_weight is not None:
+                    vals = np.where(ind == pos_q[:, None], Kt[s] * site_weight, vals)
+                cols = r_groups[s][ind]
+                if exclude_self:
+                    vals = np.where(cols == gq[:, None], -np.inf, vals)
+                cand_v.append(vals); cand_c.append(cols)
+                n_c = sum(v.shape[1] for v in cand_v)
+                if n_c >= k:
+                    V = np.hstack(cand_v)
+                    kth = np.partition(V, n_c - k, axis=1)[:, n_c - k]
+            V, Cc = np.hstack(cand_v), np.hstack(cand_c)
+            k_eff = min(k, V.shape[1])
+            sel = np.argpartition(-V, kth=k_eff-1, axis=1)[:, :k_eff]
+            v = np.take_along_axis(V, sel, axis=1)
+            keep = np.isfinite(v)
+            rows_out.append(np.repeat(gq, k_eff)[keep.ravel()])
+            cols_out.append(np.take_along_axis(Cc, sel, axis=1)[keep])
+            vals_out.append(v[keep])
+        A = sp.csr_matrix((np.concatenate(vals_out), (np.concatenate(rows_out), np.concatenate(cols_out))),
+                          shape=(len(coords_q), self.n))
+        A.sort_indices()
+        return A
+
+def spacetime_knn(coords_q, times_q, coords_r, times_r, hS, hT, k,
+                  exclude_self=False, site_weight=None, index=None):
+    """
+    Top-k space-time neighbours of every query row among the reference rows,
+    scored by exp(-0.5 (d/hS)^2) * exp(-0.5 (dt/hT)^2), without forming the
+    (n_q, n_r) score matrix. One haversine BallTree per reference period is
+    queried for its k nearest sites; periods are visited in decreasing
+    temporal weight and the scan stops once no remaining period can beat the
+    current k-th best. Returns the kernel values as CSR, shape (n_q, n_r).
+
+    exclude_self: query and reference are the same panel; a row never picks itself.
+    site_weight:  consistent-coordinates convention, the same within-period
+                  position in another period scores site_weight * K_T.
+    index:        prebuilt SpaceTimeIndex of the reference rows (reused).
+    """
+    index = index if index is not None else SpaceTimeIndex(coords_r, times_r)
+    return index.query(coords_q, times_q, hS, hT, k, exclude_self=exclude_self, site_weight=site_weight)
+
+def cross_kernel(coords_q, times_q, coords_r, times_r, hS, hT, topk=None, dtype=np.float32, index=None):
+    """
+    Dense (n_q, n_r) block exp(-0.5 (d/hS)^2) * exp(-0.5 (dt/hT)^2) between
+    query and reference rows, broadcast over haversine_matrix. With topk,
+    only each row's top-k entries (from spacetime_knn) are nonzero.
+    """
+    if topk is not None:
+        return spacetime_knn(coords_q, times_q, coords_r, times_r, hS, hT, topk,
+                             index=index).toarray().astype(dtype)
+    Ks = np.exp(-0.5 * (haversine_matrix(coords_q, coords_r) / hS) ** 2)
+    dt = np.asarray(times_q, dtype=float)[:, None] - np.asarray(times_r, dtype=float)[None, :]
+    Ks *= np.exp(-0.5 * (dt / hT) ** 2)
+    return Ks.astype(dtype, copy=False)
+
 def build_spatiotemporal_kernel(
-    coords_blocks, times, tau_s=1.0, tau_t=1.0, k_neighbors=8, prior_self_weight=1.0, verbose=True
+    coords_blocks, times, tau_s=1.0, tau_t=1.0, k_neighbors=8, prior_self_weight=1.0, verbose=True,
+    return_sparse=False, knn_index=None, cache=None, dist_dtype=np.float64
 ):
+    """
+    kNN-sparsified spatio-temporal Gaussian prior over the stacked panel.
+    Returns a dense (NT, NT) array, or a scipy CSR matrix if return_sparse.
+    With consistent coordinates the Kronecker structure is kept factored
+    (KroneckerPrior) and only the kNN result is ever materialised.
+    knn_index="balltree" finds the neighbours with per-period haversine
+    BallTrees (spacetime_knn) for either branch, never forming an (NT, NT) score.
+    cache: optional PriorCache; identical inputs load the stored CSR prior.
+    The result is in the dtype policy's storage dtype (float32 by default).
+    dist_dtype: dtype of the haversine distance blocks (see haversine_matrix).
+    """
     times = np.array(times, dtype=float)
     T = len(times)
     Ns = [cb.shape[0] for cb in coords_blocks]
+    dtype = get_policy().np_storage
+    if cache is not None:
+        key = cache.make_key(np.vstack(coords_blocks), np.asarray(Ns), times, kind="prior",
+                             tau_s=tau_s, tau_t=tau_t, k_neighbors=k_neighbors,
+                             prior_self_weight=prior_self_weight, knn_index=knn_index,
+                             storage=str(np.dtype(dtype)), dist=str(np.dtype(dist_dtype)))
+        hit = cache.load_prior(key)
+        if hit is not None:
+            if verbose:
+                print("Loaded spatio-temporal kernel from cache.")
+            A = hit[0].astype(dtype, copy=False)
+            return A if return_sparse else A.toarray()
     if verbose:
         print("Building spatio-temporal kernel...")
         print(f"Time periods: {T}, Locations(first): {Ns[0]}")
 
     # global spatial bandwidth
     all_d = []
+    D_first = None
     for C in coords_blocks:
         if len(C)>1:
-            D = _pairwise_block(C, C)
+            D = _pairwise_block(C, C, dist_dtype)
+            if D_first is None:
+                D_first = D
             all_d.append(D[D>0])
     hS = np.median(np.concatenate(all_d)) if len(all_d) else 1.0
     hS = max(hS / max(tau_s,1e-6), 1e-6)
@@ -66,33 +271,46 @@ def build_spatiotemporal_kernel(
     hT = max(hT / max(tau_t,1e-6), 1e-6)
 
     consistent = (len(set(Ns))==1) and _check_consistent(coords_blocks)
-    if consistent:
+    if knn_index == "balltree":
+        C_all = np.vstack(coords_blocks)
+        t_all = np.repeat(times, Ns)
+        n = len(C_all)
+        k_eff = min(k_neighbors, max(1, n-1))
+        W_sparse = spacetime_knn(C_all, t_all, C_all, t_all, hS, hT, k_eff, exclude_self=True,
+                                 site_weight=prior_self_weight if consistent else None)
+        W_sparse = _csr_row_normalize(W_sparse + sp.identity(n, format="csr") * prior_self_weight).tocsr()
+    elif knn_index is not None:
+        raise ValueError(f"Unknown knn_index: {knn_index}")
+    elif consistent:
         C0 = coords_blocks[0]
-        D0 = _pairwise_block(C0, C0)
+        D0 = D_first if D_first is not None else _pairwise_block(C0, C0, dist_dtype)
         K_S = np.exp(-0.5 * (D0/hS)**2)
         np.fill_diagonal(K_S, prior_self_weight)
         K_T = np.exp(-0.5 * (Dt/hT)**2)
         np.fill_diagonal(K_T, 1.0)
-        W_full = np.kron(K_T, K_S).astype(np.float64)
+        W_sparse = KroneckerPrior(K_T, K_S).knn(k_neighbors, self_w=prior_self_weight)
     else:
         if verbose:
             print("Using adaptive cross-time kernel...")
         N_total = sum(Ns)
-        W_full = np.zeros((N_total, N_total), dtype=np.float64)
+        C_all = np.vstack(coords_blocks)
+        t_all = np.repeat(times, Ns)
+        W_full = np.zeros((N_total, N_total), dtype=dtype)
         r0 = 0
         for i in range(T):
-            C1, n1 = coords_blocks[i], Ns[i]
-            c0 = 0
-            for j in range(T):
-                C2, n2 = coords_blocks[j], Ns[j]
-                Dij = _pairwise_block(C1, C2)
-                Ks = np.exp(-0.5 * (Dij/hS)**2)
-                Kt = math.exp(-0.5 * ((abs(times[i]-times[j]) / hT)**2))
-                W_full[r0:r0+n1, c0:c0+n2] = Kt * Ks
-                c0 += n2
+            # one (n_i, N_total) distance block per period instead of T blocks
+            n1 = Ns[i]
+            Ks = np.exp(-0.5 * (_pairwise_block(coords_blocks[i], C_all, dist_dtype)/hS)**2)
+            Kt = np.exp(-0.5 * ((np.abs(times[i]-t_all) / hT)**2))
+            W_full[r0:r0+n1] = Kt[None, :] * Ks
             r0 += n1
 
-    W_sparse = _sparsify_knn(W_full, k_neighbors, self_w=prior_self_weight)
+        W_sparse = sp.csr_matrix(_sparsify_knn(W_full, k_neighbors, self_w=prior_self_weight))
+        del W_full
+
     if verbose:
-        print(f"Kernel construction complete. Sparsity: {np.mean(W_sparse==0):.3f}")
-    return W_sparse
+        print(f"Kernel construction complete. Sparsity: {1.0 - W_sparse.count_nonzero() / np.prod(W_sparse.shape):.3f}")
+    W_sparse = W_sparse.astype(dtype, copy=False)
+    if cache is not None:
+        cache.save_prior(key, W_sparse, hS=float(hS), hT=float(hT))
+    return W_sparse if return_sparse else W_sparse.toarray()
@@ -3,6 +3,7 @@ import math
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from .precision import get_policy
 
 
 class MathematicallyCorrectGNNWeightNet(nn.Module):
@@ -47,9 +48,11 @@ class MathematicallyCorrectGNNWeightNet(nn.Module):
         X: (N, p) float32
         A_prior: (N, N) float32, row-stochastic-ish prior (nonnegative)
         """
-        H = self.encoder(X)                 # (N, emb)
-        Hn = F.normalize(H, p=2, dim=1)     # cosine sim works best if normalized
-        S = Hn @ Hn.t()                     # (N, N), cosine in [-1, 1]
+        with get_policy().encoder_autocast(X.device):
+            H = self.encoder(X)                 # (N, emb)
+            Hn = F.normalize(H, p=2, dim=1)     # cosine sim works best if normalized
+            S = Hn @ Hn.t()                     # (N, N), cosine in [-1, 1]
+        H, S = H.to(X.dtype), S.to(X.dtype)
         logits = S / self.tau               # temperature scaling
 
         # log-opinion-pooling with prior
@@ -60,9 +63,58 @@ class MathematicallyCorrectGNNWeightNet(nn.Module):
         W = F.softmax(log_combined, dim=1)
         return W, H
 
+    def forward_sparse(self, X, nbr_idx, nbr_prior, rows=None):
+        """
+        Same blend as forward(), but logits are only formed on each row's
+        candidate edges (typically the kNN prior's neighbour lists), followed
+        by a per-row (segment) softmax over those edges. No N x N tensor.
+        X: (N, p); nbr_idx, nbr_prior: (N, k), padding slots have prior 0.
+        rows: optional (B,) positions in X of the query rows; nbr_idx and
+              nbr_prior are then (B, k) (mini-batch subgraphs).
+
+        Returns:
+          - W: (idx, w) neighbour lists, (N, k) or (B, k), rows sum to 1
+          - H: (N, emb) node embeddings
+        Unlike forward(), non-neighbours get exactly zero weight.
+        """
+        with get_policy().encoder_autocast(X.device):
+            H = self.encoder(X)
+            Hn = F.normalize(H, p=2, dim=1)
+            Hq = Hn if rows is None else Hn[rows]
+            S = (Hq.unsqueeze(1) * Hn[nbr_idx]).sum(dim=2)     # (N, k) cosine on edges
+        H, S = H.to(X.dtype), S.to(X.dtype)
+        logits = S / self.tau
+        log_prior = torch.log(nbr_prior + 1e-12)
+        log_combined = self.alpha * log_prior + (1.0 - self.alpha) * logits
+        log_combined = log_combined.masked_fill(nbr_prior <= 0, float("-inf"))
+        w = F.softmax(log_combined, dim=1)
+        return (nbr_idx, w), H
+
 
 # ---------- Graph post-processing helpers (optional) ----------
 
+def prior_neighbors(A_prior, device=None):
+    """
+    Padded neighbour lists (idx, w) of a kNN prior given as a scipy CSR
+    matrix, a NumPy array or a dense tensor; padding has idx 0 and w 0.
+    """
+    import numpy as np
+    import scipy.sparse as sp
+    if torch.is_tensor(A_prior):
+        A_prior = A_prior.detach().cpu().numpy()
+    A = sp.csr_matrix(A_prior, copy=True)   # eliminate_zeros must not touch the caller's matrix
+    A.eliminate_zeros()
+    counts = np.diff(A.indptr)
+    k = max(int(counts.max()) if len(counts) else 0, 1)
+    rows = np.repeat(np.arange(A.shape[0]), counts)
+    pos = np.arange(A.nnz) - A.indptr[rows]
+    idx = np.zeros((A.shape[0], k), dtype=np.int64)
+    w = np.zeros((A.shape[0], k), dtype=get_policy().np_storage)
+    idx[rows, pos] = A.indices
+    w[rows, pos] = A.data
+    return torch.as_tensor(idx, device=device), torch.as_tensor(w, device=device)
+
+
 def _row_normalize(W: torch.Tensor, eps: float = 1e-12) -> torch.Tensor:
     """Row-normalize a nonnegative matrix to sum to 1 per row."""
     row_sum = W.sum(dim=1, keepdim=True)
@@ -86,6 +138,23 @@ def topk_rows(W: torch.Tensor, k: int) -> torch.Tensor:
     return _row_normalize(W_pruned)
 
 
+def topk_neighbors(W, k: int):
+    """
+    Same pruning as topk_rows, but returns padded neighbour lists (idx, w),
+    each (N, k), for the sparse local-WLS engine instead of a dense matrix.
+    W may itself be (idx, w) neighbour lists (e.g. from forward_sparse).
+    """
+    if isinstance(W, tuple):
+        nbr_idx, w = W
+        k_eff = max(1, min(k, w.shape[1]))
+        vals, pos = torch.topk(w, k_eff, dim=1)
+        return torch.gather(nbr_idx, 1, pos), _row_normalize(vals)
+    n = W.shape[1]
+    k_eff = max(1, min(k, n))
+    vals, idx = torch.topk(W, k_eff, dim=1)
+    return idx, _row_normalize(vals)
+
+
 def symmetrize_rows(W: torch.Tensor) -> torch.Tensor:
     """
     Make W symmetric by averaging with its transpose, then row-normalize.
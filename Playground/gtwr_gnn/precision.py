@@ -0,0 +1,100 @@
+from contextlib import contextmanager
+import numpy as np
+import torch
+
+# -----------------------------------------------------------------------------
+# Dtype policy shared by the prior builder, the model and the WLS solvers.
+#   storage: priors, features, W and every tensor handed to the model
+#   solve:   the batched p x p factorisations (None = same as storage)
+#   encoder: optional autocast dtype (bfloat16) for encoder + cosine similarity;
+#            the prior blend and softmax stay in storage dtype
+# Presets: "float32" (default), "float64", "mixed" (float32 storage, float64
+# solves), "bf16" (mixed + bfloat16 encoder/similarity).
+# -----------------------------------------------------------------------------
+_DTYPES = {"float32": torch.float32, "float64": torch.float64, "bfloat16": torch.bfloat16}
+
+
+def _as_torch_dtype(d):
+    if d is None or isinstance(d, torch.dtype):
+        return d
+    return _DTYPES[str(np.dtype(d)) if not isinstance(d, str) else d]
+
+
+class DtypePolicy:
+    PRESETS = {
+        "float32": dict(storage="float32", solve=None, encoder=None),
+        "float64": dict(storage="float64", solve=None, encoder=None),
+        "mixed":   dict(storage="float32", solve="float64", encoder=None),
+        "bf16":    dict(storage="float32", solve="float64", encoder="bfloat16"),
+    }
+
+    def __init__(self, storage="float32", solve=None, encoder=None):
+        self.storage = _as_torch_dtype(storage)
+        self.solve = _as_torch_dtype(solve) or self.storage
+        self.encoder = _as_torch_dtype(encoder)
+        if self.storage not in (torch.float32, torch.float64):
+            raise ValueError("storage dtype must be float32 or float64")
+
+    @classmethod
+    def resolve(cls, policy):
+        """A DtypePolicy from a preset name, an existing policy, or None (the active one)."""
+        if policy is None:
+            return get_policy()
+        if isinstance(policy, DtypePolicy):
+            return policy
+        if policy not in cls.PRESETS:
+            raise ValueError(f"Unknown dtype policy: {policy}")
+        return cls(**cls.PRESETS[policy])
+
+    @property
+    def np_storage(self):
+        return np.float64 if self.storage == torch.float64 else np.float32
+
+    def solve_dtype(self, dtype):
+        """Dtype to factorise a system held in dtype: never narrower than dtype."""
+        return torch.promote_types(dtype, self.solve)
+
+    def encoder_autocast(self, device):
+        """Autocast context for the encoder/similarity (no-op unless encoder is set)."""
+        dev = torch.device(device).type if not isinstance(device, str) else device
+        return torch.autocast(device_type=dev, dtype=self.encoder or torch.bfloat16,
+                              enabled=self.encoder is not None)
+
+    def __repr__(self):
+        return f"DtypePolicy(storage={self.storage}, solve={self.solve}, encoder={self.encoder})"
+
+
+_ACTIVE = [DtypePolicy()]
+
+
+def get_policy():
+    return _ACTIVE[-1]
+
+
+def set_policy(policy):
+    """Make policy (preset name or DtypePolicy) the process-wide default."""
+    _ACTIVE[0] = DtypePolicy.resolve(policy)
+    del _ACTIVE[1:]
+
+
+@contextmanager
+def dtype_policy(policy):
+    """Temporarily use policy:  with dtype_policy("mixed"): train_model(...)"""
+    _ACTIVE.append(DtypePolicy.resolve(policy))
+    try:
+        yield _ACTIVE[-1]
+    finally:
+        _ACTIVE.pop()
+
+
+def as_storage(a, device=None, dtype=None):
+    """
+    Tensor in the active storage dtype (or dtype, e.g. a model's parameter
+    dtype); shares memory with a when dtype and device already match.
+    """
+    dtype = dtype or get_policy().storage
+    if hasattr(a, "toarray"):
+        a = a.toarray()
+    if isinstance(a, np.ndarray) and not a.flags.writeable:
+        a = np.array(a)                                  # torch cannot share read-only memory
+    return torch.as_tensor(a, dtype=dtype, device=device)
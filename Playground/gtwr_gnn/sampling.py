@@ -0,0 +1,92 @@
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# Mini-batch (subgraph) sampling over the kNN prior
+#   - A batch is a set of target rows plus their (optionally sub-sampled)
+#     prior neighbours; W rows and local WLS are only formed for the targets.
+#   - One hop is enough: the encoder is per-node, and a target's local system
+#     only touches its own neighbours' X, y.
+# -----------------------------------------------------------------------------
+SubgraphBatch = namedtuple("SubgraphBatch", ["nodes", "targets", "target_pos", "nbr_idx", "nbr_prior"])
+SubgraphBatch.__doc__ = """
+nodes:      (M,) global row ids of every row the batch touches (sorted)
+targets:    (B,) global row ids of the batch's target rows
+target_pos: (B,) position of each target in nodes
+nbr_idx:    (B, k) neighbour positions in nodes (padding: 0)
+nbr_prior:  (B, k) prior weights of those edges (padding: 0)
+"""
+
+
+class NeighborSampler:
+    """
+    GraphSAGE-style neighbour sampler over padded prior neighbour lists
+    (idx, w), e.g. model.prior_neighbors(A_prior) moved to NumPy.
+    num_neighbors=None keeps every prior neighbour; otherwise each target
+    keeps num_neighbors of them, drawn without replacement with probability
+    proportional to the prior weight.
+    """
+    def __init__(self, nbr_idx, nbr_prior, num_neighbors=None):
+        self.nbr_idx = np.asarray(nbr_idx, dtype=np.int64)
+        self.nbr_prior = np.asarray(nbr_prior, dtype=np.float32)
+        k = self.nbr_idx.shape[1]
+        self.num_neighbors = None if (num_neighbors is None or num_neighbors >= k) else int(num_neighbors)
+
+    def sample(self, targets, rng=None):
+        targets = np.asarray(targets, dtype=np.int64)
+        idx, w = self.nbr_idx[targets], self.nbr_prior[targets]
+        if self.num_neighbors is not None:
+            rng = rng if rng is not None else np.random.default_rng()
+            # Gumbel top-k == weighted sampling without replacement; padding never wins
+            with np.errstate(divide="ignore"):
+                keys = np.log(w) + rng.gumbel(size=w.shape)
+            keep = np.argpartition(-keys, self.num_neighbors - 1, axis=1)[:, :self.num_neighbors]
+            idx, w = np.take_along_axis(idx, keep, 1), np.take_along_axis(w, keep, 1)
+        valid = w > 0
+        nodes = np.unique(np.concatenate([targets, idx[valid]]))
+        local = np.where(valid, np.searchsorted(nodes, idx), 0)
+        return SubgraphBatch(nodes, targets, np.searchsorted(nodes, targets), local, np.where(valid, w, 0.0))
+
+
+class BatchLoader:
+    """
+    Iterates shuffled target batches of `rows` and samples their subgraphs.
+    With num_workers > 0, batches are sampled ahead in worker threads
+    (up to prefetch per worker) while the current step runs. Each batch
+    draws from its own seeded RNG, so results do not depend on num_workers.
+    """
+    def __init__(self, sampler, rows, batch_size, shuffle=True, num_workers=0, prefetch=2, seed=0):
+        self.sampler = sampler
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.batch_size = int(batch_size)
+        self.shuffle = shuffle
+        self.num_workers = int(num_workers)
+        self.prefetch = max(1, int(prefetch))
+        self.seed = seed
+        self.epoch = 0
+
+    def __len__(self):
+        return -(-len(self.rows) // self.batch_size)
+
+    def _jobs(self):
+        rng = np.random.default_rng((self.seed, self.epoch))
+        order = rng.permutation(self.rows) if self.shuffle else self.rows
+        for b, start in enumerate(range(0, len(order), self.batch_size)):
+            yield order[start:start + self.batch_size], np.random.default_rng((self.seed, self.epoch, b))
+
+    def __iter__(self):
+        jobs = self._jobs()
+        self.epoch += 1
+        if self.num_workers <= 0:
+            for targets, rng in jobs:
+                yield self.sampler.sample(targets, rng)
+            return
+        with ThreadPoolExecutor(self.num_workers) as ex:
+            pending = deque()
+            for targets, rng in jobs:
+                pending.append(ex.submit(self.sampler.sample, targets, rng))
+                if len(pending) >= self.num_workers * self.prefetch:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
@@ -0,0 +1,348 @@
+import argparse
+import http.client
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# Local scoring service over a trained artifact (HTTP on TCP or a Unix socket)
+#   - The artifact is loaded once; scoring goes through IncrementalScorer
+#     (NEW→OLD weights + the NEW rows' local solves only).
+#   - Concurrent requests are micro-batched: the worker takes the first
+#     queued request, keeps collecting for up to max_wait_ms or until
+#     max_batch_rows, scores everything in one call and splits the result.
+#     NEW rows only see OLD rows and themselves, so batching does not change
+#     a prediction (beyond float rounding).
+#   - The request queue is bounded; when it is full the request is refused
+#     with 503 instead of growing the tail latency. A request not scored
+#     within request_timeout gets 504 and is dropped from the queue.
+#     POST /predict   {"X": [[...]], "coords": [[lat, lon]], "times": [...]}
+#                     or {"records": [{feature cols, lat, lon, time}, ...]}
+#     GET  /metrics   counters, batch sizes, latency percentiles
+#     GET  /health
+#   python -m gtwr_gnn.server ARTIFACT --port 8080
+#   python -m gtwr_gnn.server ARTIFACT --unix-socket /tmp/gtwr.sock
+# -----------------------------------------------------------------------------
+class Overloaded(RuntimeError):
+    """The request queue is full."""
+
+
+class ServiceMetrics:
+    """
+    Thread-safe counters plus latency percentiles over the last `window`
+    requests that reached the queue, scored or timed out (the tail).
+    """
+    def __init__(self, window=10000, latency_budget_ms=None):
+        self.latency_budget_ms = latency_budget_ms
+        self._lock = threading.Lock()
+        self._lat = deque(maxlen=window)
+        self.started = time.perf_counter()
+        self.requests = self.rows = self.rejected = self.errors = self.timeouts = self.over_budget = 0
+        self.batches = self.batch_rows = 0
+        self.score_s = 0.0
+
+    def _latency(self, latency_s):
+        self._lat.append(latency_s)
+        if self.latency_budget_ms is not None and latency_s * 1e3 > self.latency_budget_ms:
+            self.over_budget += 1
+
+    def request(self, latency_s, n_rows):
+        with self._lock:
+            self._latency(latency_s)
+            self.requests += 1
+            self.rows += n_rows
+
+    def timeout(self, latency_s):
+        with self._lock:
+            self._latency(latency_s)
+            self.timeouts += 1
+
+    def batch(self, n_rows, seconds):
+        with self._lock:
+            self.batches += 1
+            self.batch_rows += n_rows
+            self.score_s += seconds
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self, queue_depth=None):
+        with self._lock:
+            lat = np.asarray(self._lat) * 1e3
+            uptime = time.perf_counter() - self.started
+            out = dict(uptime_s=uptime, requests=self.requests, rows=self.rows, rejected=self.rejected,
+                       errors=self.errors, timeouts=self.timeouts, batches=self.batches,
+                       mean_batch_rows=self.batch_rows / self.batches if self.batches else 0.0,
+                       requests_per_s=self.requests / uptime, rows_per_s=self.rows / uptime,
+                       score_time_s=self.score_s, queue_depth=queue_depth)
+            for q in (50, 90, 99):
+                out[f"latency_p{q}_ms"] = float(np.percentile(lat, q)) if len(lat) else None
+            out["latency_max_ms"] = float(lat.max()) if len(lat) else None
+            if self.latency_budget_ms is not None:
+                out.update(latency_budget_ms=self.latency_budget_ms, over_budget=self.over_budget,
+                           p99_within_budget=None if not len(lat) else out["latency_p99_ms"] <= self.latency_budget_ms)
+            return out
+
+
+class MicroBatcher:
+    """
+    Single scoring thread fed by a bounded queue. submit() blocks until the
+    request's rows are scored and raises Overloaded when max_queue requests
+    are already waiting.
+    """
+    def __init__(self, scorer, max_batch_rows=1024, max_wait_ms=2.0, max_queue=256, metrics=None):
+        self.scorer = scorer
+        self.max_batch_rows = int(max_batch_rows)
+        self.max_wait = max_wait_ms / 1e3
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.metrics = metrics or ServiceMetrics()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="gtwr-batcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def prepare(self, X, coords, times):
+        """Validated (X, coords, times) arrays; raises ValueError before anything is queued."""
+        X = np.asarray(X, dtype=np.float32)
+        coords = np.asarray(coords, dtype=np.float32).reshape(-1, 2)
+        times = np.asarray(times, dtype=float).reshape(-1)
+        if not (X.ndim == 2 and len(X) == len(coords) == len(times)):
+            raise ValueError("X, coords and times must have the same number of rows")
+        if X.shape[1] != self.scorer.X_old.shape[1]:     # would fail the whole batch otherwise
+            raise ValueError(f"expected {self.scorer.X_old.shape[1]} features, got {X.shape[1]}")
+        return X, coords, times
+
+    def submit(self, X, coords, times, timeout=None):
+        """Scored rows; raises Overloaded, or TimeoutError after timeout seconds."""
+        X, coords, times = self.prepare(X, coords, times)
+        fut = Future()
+        try:
+            self.queue.put_nowait((X, coords, times, fut))
+        except queue.Full:
+            self.metrics.count("rejected")
+            raise Overloaded("request queue is full") from None
+        try:
+            return fut.result(timeout)
+        except FutureTimeout:
+            fut.cancel()          # still queued: the batcher drops it; already scoring: result is discarded
+            raise
+
+    def _collect(self):
+        batch, n, deadline = [], 0, None
+        while n < self.max_batch_rows:
+            wait = 0.1 if deadline is None else deadline - time.perf_counter()
+            if wait <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=wait)
+            except queue.Empty:
+                break
+            if not item[3].set_running_or_notify_cancel():    # caller timed out while queued
+                continue
+            if deadline is None:
+                deadline = time.perf_counter() + self.max_wait
+            batch.append(item)
+            n += len(item[0])
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect()
+            if not batch:
+                continue
+            t0 = time.perf_counter()
+            try:
+                y = self.scorer.score(np.concatenate([b[0] for b in batch]), np.concatenate([b[1] for b in batch]),
+                                      np.concatenate([b[2] for b in batch]))
+            except Exception as e:           # fail this batch's requests, keep serving
+                for b in batch:
+                    b[3].set_exception(e)
+                continue
+            self.metrics.batch(len(y), time.perf_counter() - t0)
+            ends = np.cumsum([len(b[0]) for b in batch])[:-1]
+            for b, part in zip(batch, np.split(y, ends)):
+                b[3].set_result(part)
+
+
+# ---------- HTTP front end ----------
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def address_string(self):
+        return self.client_address[0] if self.client_address else "unix"
+
+    def _reply(self, code, body, headers=()):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in headers:
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        srv = self.server
+        if self.path == "/metrics":
+            self._reply(200, srv.batcher.metrics.snapshot(srv.batcher.queue.qsize()))
+        elif self.path == "/health":
+            self._reply(200, dict(status="ok", n_old=srv.batcher.scorer.n_old, feature_cols=srv.feature_cols))
+        else:
+            self._reply(404, dict(error=f"unknown path {self.path}"))
+
+    def do_POST(self):
+        srv = self.server
+        if self.path != "/predict":
+            return self._reply(404, dict(error=f"unknown path {self.path}"))
+        t0 = time.perf_counter()
+        try:
+            req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            X, coords, times = srv.batcher.prepare(*srv.parse(req))
+        except (ValueError, KeyError, TypeError) as e:
+            srv.batcher.metrics.count("errors")
+            return self._reply(400, dict(error=f"bad request: {e}"))
+        try:
+            y = srv.batcher.submit(X, coords, times, timeout=srv.request_timeout)
+        except Overloaded as e:
+            return self._reply(503, dict(error=str(e)), headers=[("Retry-After", "1")])
+        except FutureTimeout:
+            srv.batcher.metrics.timeout(time.perf_counter() - t0)
+            return self._reply(504, dict(error=f"not scored within {srv.request_timeout} s"))
+        except Exception as e:
+            srv.batcher.metrics.count("errors")
+            return self._reply(500, dict(error=f"{type(e).__name__}: {e}"))
+        srv.batcher.metrics.request(time.perf_counter() - t0, len(y))
+        self._reply(200, dict(y_hat=y.tolist()))
+
+
+class _ServiceMixin:
+    daemon_threads = True
+    request_queue_size = 128          # listen backlog; socketserver's default of 5 resets bursts
+
+    def setup_service(self, batcher, feature_cols, lat_col, lon_col, time_col, request_timeout, verbose):
+        self.batcher, self.feature_cols = batcher, feature_cols
+        self.lat_col, self.lon_col, self.time_col = lat_col, lon_col, time_col
+        self.request_timeout, self.verbose = request_timeout, verbose
+
+    def parse(self, req):
+        if "records" in req:
+            if self.feature_cols is None:
+                raise ValueError("records need an artifact saved with feature_cols; send X/coords/times")
+            recs = req["records"]
+            return ([[r[c] for c in self.feature_cols] for r in recs],
+                    [[r[self.lat_col], r[self.lon_col]] for r in recs], [r[self.time_col] for r in recs])
+        return req["X"], req["coords"], req["times"]
+
+    def shutdown(self):
+        super().shutdown()
+        self.batcher.stop()
+
+
+class ScoringHTTPServer(_ServiceMixin, ThreadingHTTPServer):
+    pass
+
+
+class ScoringUnixServer(_ServiceMixin, socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def make_server(
+    artifact, host="127.0.0.1", port=8080, unix_socket=None,
+    max_batch_rows=1024, max_wait_ms=2.0, max_queue=256, latency_budget_ms=None, request_timeout=30.0,
+    lat_col="lat", lon_col="lon", time_col="year", device=None, verbose=False, **scorer_overrides
+):
+    """
+    Build (not start) a scoring server. artifact is a path, an
+    artifacts.Artifact or an IncrementalScorer. The batcher is started and
+    warmed up with one OLD row; run with server.serve_forever(), stop with
+    server.shutdown(); server.server_close() releases the socket.
+    """
+    feature_cols = None
+    if hasattr(artifact, "score"):
+        scorer = artifact
+    else:
+        from .artifacts import Artifact, load_artifact
+        if not isinstance(artifact, Artifact):
+            artifact = load_artifact(artifact, device=device)
+        scorer, feature_cols = artifact.scorer(device=device, **scorer_overrides), artifact.feature_cols
+    scorer.score(scorer.X_old[:1].cpu().numpy(), scorer.coords_old[:1], scorer.times_old[:1])   # warm-up
+    batcher = MicroBatcher(scorer, max_batch_rows, max_wait_ms, max_queue,
+                           ServiceMetrics(latency_budget_ms=latency_budget_ms)).start()
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.unlink(unix_socket)
+        srv = ScoringUnixServer(unix_socket, _Handler)
+    else:
+        srv = ScoringHTTPServer((host, port), _Handler)
+    srv.setup_service(batcher, feature_cols, lat_col, lon_col, time_col, request_timeout, verbose)
+    return srv
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """http.client connection over a Unix socket, for talking to ScoringUnixServer."""
+    def __init__(self, path, timeout=30.0):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="gtwr_gnn local scoring server")
+    ap.add_argument("artifact")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--unix-socket", default=None)
+    ap.add_argument("--max-batch-rows", type=int, default=1024)
+    ap.add_argument("--max-wait-ms", type=float, default=2.0)
+    ap.add_argument("--max-queue", type=int, default=256)
+    ap.add_argument("--latency-budget-ms", type=float, default=None)
+    ap.add_argument("--time-col", default="year")
+    ap.add_argument("--verbose", action="store_true")
+    args = ap.parse_args(argv)
+    srv = make_server(args.artifact, args.host, args.port, args.unix_socket, args.max_batch_rows,
+                      args.max_wait_ms, args.max_queue, args.latency_budget_ms,
+                      time_col=args.time_col, verbose=args.verbose)
+    print(f"Serving {args.artifact} on {args.unix_socket or f'http://{args.host}:{args.port}'}")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.batcher.stop()
+        srv.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,55 @@
+import numpy as np
+import scipy.sparse as sp
+import torch
+from multiprocessing import shared_memory
+
+# -----------------------------------------------------------------------------
+# Shared-memory arrays for process-pool workers (sweep.py, simulation.py)
+#   parent:  blocks, specs = share_arrays(dict(X=..., **prior_arrays(A)))
+#            ProcessPoolExecutor(..., initializer=init_worker, initargs=(specs, threads))
+#            ... release(blocks)
+#   worker:  WORKER["data"][name] is a zero-copy view; worker_prior() the prior
+# -----------------------------------------------------------------------------
+WORKER = {}
+
+
+def prior_arrays(A):
+    """Arrays to share for a prior: CSR parts if A is sparse, else a dense float32 A."""
+    if sp.issparse(A):
+        A = sp.csr_matrix(A)
+        return dict(A_data=A.data, A_indices=A.indices, A_indptr=A.indptr, A_shape=np.asarray(A.shape))
+    return dict(A=np.asarray(A, dtype=np.float32))
+
+
+def share_arrays(arrays):
+    """Copy arrays into new shared-memory blocks. Returns (blocks, specs); specs goes to init_worker."""
+    blocks, specs = [], {}
+    for name, a in arrays.items():
+        a = np.ascontiguousarray(a)
+        shm = shared_memory.SharedMemory(create=True, size=max(a.nbytes, 1))
+        np.ndarray(a.shape, a.dtype, buffer=shm.buf)[...] = a
+        blocks.append(shm)
+        specs[name] = (shm.name, a.shape, a.dtype.str)
+    return blocks, specs
+
+
+def release(blocks):
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+
+
+def init_worker(specs, threads):
+    """Pool initializer: set torch threads and attach the shared arrays to WORKER["data"]."""
+    torch.set_num_threads(threads)
+    WORKER["shm"] = [shared_memory.SharedMemory(name=n) for n, _, _ in specs.values()]
+    WORKER["data"] = {name: np.ndarray(shape, np.dtype(dt), buffer=shm.buf)
+                      for (name, (_, shape, dt)), shm in zip(specs.items(), WORKER["shm"])}
+
+
+def worker_prior():
+    """The prior shared by prior_arrays, as a CSR view or the dense array."""
+    d = WORKER["data"]
+    if "A_data" in d:
+        return sp.csr_matrix((d["A_data"], d["A_indices"], d["A_indptr"]), shape=tuple(d["A_shape"]))
+    return d["A"]
@@ -0,0 +1,142 @@
+import contextlib
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+import numpy as np
+import pandas as pd
+import torch
+
+from .kernels import build_spatiotemporal_kernel
+from .wls import solve_local_wls
+from .model import MathematicallyCorrectGNNWeightNet, prior_neighbors
+from .train import train_model
+from .shm import WORKER, init_worker, prior_arrays, release, share_arrays, worker_prior
+
+# -----------------------------------------------------------------------------
+# Monte Carlo / bootstrap studies of the local coefficients
+#   y_r = sum_j X_r[:, j] * beta_true[:, j] + sigma * eps_r ,  r = 0..n_reps-1
+#   - Replicate r draws from default_rng([seed, r]): results do not depend on
+#     the number of workers or on scheduling order.
+#   - Replicates run in fixed chunks; within a chunk the GNN warm-starts from
+#     the previous replicate's weights (the chunk's first one from seed).
+#   - Estimated coefficients are written straight into a (n_reps, n, p) .npy
+#     memmap, so nothing is held in memory and a crash keeps finished replicates.
+# -----------------------------------------------------------------------------
+def simulate_replicate(true_betas, sigma, rng, X=None):
+    """One replicate (X, y). X=None draws a fresh design with an intercept column."""
+    n, p = true_betas.shape
+    if X is None:
+        X = np.column_stack([np.ones(n), rng.normal(size=(n, p - 1))]).astype(np.float32)
+    y = (X * true_betas).sum(axis=1) + sigma * rng.normal(size=n)
+    return X, y.astype(np.float32)
+
+
+def _run_chunk(job):
+    start, stop, method, sigma, seed, out_path, fit_kwargs = job
+    d = WORKER["data"]
+    true_betas, X_fixed = d["true_betas"], d.get("X")
+    A = worker_prior()
+    betas_out = np.load(out_path, mmap_mode="r+")
+    model, rows = None, []
+    if method == "gtwr":
+        A_nbr = prior_neighbors(A)               # kNN prior: solve on its neighbour lists
+    for r in range(start, stop):
+        rng = np.random.default_rng([seed, r])
+        X, y = simulate_replicate(true_betas, sigma, rng, X_fixed)
+        t0 = time.perf_counter()
+        if method == "gtwr":
+            y_hat, betas = solve_local_wls(torch.as_tensor(X), torch.as_tensor(y), A_nbr,
+                                           kind=fit_kwargs.get("wls_kind", "ridge"),
+                                           ridge=fit_kwargs.get("ridge_lambda", 5.0))
+        else:
+            model_kw = dict(fit_kwargs.get("model_kwargs", {}))
+            train_kw = {k: v for k, v in fit_kwargs.items() if k != "model_kwargs"}
+            train_kw.setdefault("print_every", 10**9)
+            if model is None:                     # chunk start: fresh, seeded init
+                torch.manual_seed(seed * 100003 + r)
+                model = MathematicallyCorrectGNNWeightNet(X.shape[1], **model_kw)
+            with contextlib.redirect_stdout(io.StringIO()):
+                out = train_model(model, X, y, A, train_kw.pop("train_rows", np.arange(len(y))), **train_kw)
+            y_hat, betas = out["y_hat"], out["betas"]
+        betas = betas.detach().cpu().numpy()
+        betas_out[r] = betas
+        rows.append(dict(replicate=r, rmse_y=float(np.sqrt(np.mean((y_hat.detach().cpu().numpy() - y) ** 2))),
+                         mae_beta=float(np.mean(np.abs(betas - true_betas))),
+                         time_s=time.perf_counter() - t0))
+    betas_out.flush()
+    return rows
+
+
+def run_simulation(
+    true_betas, coords_blocks, times, n_reps, sigma=0.5, method="gnn", X=None,
+    out_path="simulation_betas.npy", seed=0, chunk_size=25, n_workers=None, threads_per_worker=1,
+    tau_s=1.0, tau_t=1.0, k_neighbors=8, prior_self_weight=1.0, cache=None, mp_context="spawn",
+    **fit_kwargs
+):
+    """
+    Refit the pipeline on n_reps simulated replicates of one panel.
+
+    true_betas: (n, p) true local coefficients of the stacked panel
+                (column 0 multiplies the intercept when X is None).
+    method:     "gtwr" (prior weights, local WLS) or "gnn" (train_model).
+    X:          optional fixed (n, p) design; otherwise drawn per replicate.
+    fit_kwargs: train_model arguments (epochs, graph_topk, ...; times and
+                N_per_year default to the panel's), model_kwargs for the net,
+                or wls_kind/ridge_lambda for gtwr.
+
+    The prior is built once and shared with the workers. Estimated
+    coefficients go to out_path as a (n_reps, n, p) float32 .npy; returns a
+    per-replicate table (rmse_y, mae_beta, time_s), also written next to it
+    as CSV. Use summarize_replicates for bias / variance per coefficient.
+    """
+    if method not in ("gtwr", "gnn"):
+        raise ValueError(f"Unknown simulation method: {method}")
+    true_betas = np.asarray(true_betas, dtype=np.float32)
+    Ns = [len(c) for c in coords_blocks]
+    fit_kwargs.setdefault("times", np.asarray(times))
+    fit_kwargs.setdefault("N_per_year", Ns[0] if len(set(Ns)) == 1 else np.concatenate([[0], np.cumsum(Ns)]))
+    A = build_spatiotemporal_kernel(coords_blocks, times, tau_s=tau_s, tau_t=tau_t, k_neighbors=k_neighbors,
+                                    prior_self_weight=prior_self_weight, verbose=False,
+                                    return_sparse=True, cache=cache)
+    arrays = dict(true_betas=true_betas, **prior_arrays(A))
+    if X is not None:
+        arrays["X"] = np.asarray(X, dtype=np.float32)
+
+    np.lib.format.open_memmap(out_path, mode="w+", dtype=np.float32, shape=(n_reps,) + true_betas.shape).flush()
+    jobs = [(s, min(s + chunk_size, n_reps), method, sigma, seed, out_path, fit_kwargs)
+            for s in range(0, n_reps, chunk_size)]
+    n_workers = n_workers or max(1, (os.cpu_count() or 1) // threads_per_worker)
+    blocks, specs = share_arrays(arrays)
+    rows = []
+    try:
+        with ProcessPoolExecutor(min(n_workers, len(jobs)), mp_context=get_context(mp_context),
+                                 initializer=init_worker, initargs=(specs, threads_per_worker)) as ex:
+            for fut in as_completed([ex.submit(_run_chunk, j) for j in jobs]):
+                rows.extend(fut.result())
+    finally:
+        release(blocks)
+
+    df = pd.DataFrame(rows).sort_values("replicate").reset_index(drop=True)
+    df.to_csv(os.path.splitext(out_path)[0] + ".csv", index=False)
+    return df
+
+
+def summarize_replicates(betas, true_betas, locations=None):
+    """
+    Per location and coefficient: true value, replicate mean / std, bias and
+    RMSE. betas is the (n_reps, n, p) array or the .npy path from run_simulation.
+    """
+    B = np.load(betas, mmap_mode="r") if isinstance(betas, (str, os.PathLike)) else np.asarray(betas)
+    true_betas = np.asarray(true_betas)
+    n, p = true_betas.shape
+    mean = B.mean(axis=0)
+    std = B.std(axis=0, ddof=1) if B.shape[0] > 1 else np.zeros((n, p))
+    rmse = np.sqrt(((B - true_betas) ** 2).mean(axis=0))
+    loc = np.arange(n) if locations is None else np.asarray(locations)
+    return pd.DataFrame(dict(
+        Location=np.repeat(loc, p), Parameter=np.tile([f"β_{j}" for j in range(p)], n),
+        True_Value=true_betas.ravel(), Mean=mean.ravel(), Std=std.ravel(),
+        Bias=(mean - true_betas).ravel(), RMSE=rmse.ravel()
+    ))
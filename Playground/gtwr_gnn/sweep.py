@@ -0,0 +1,157 @@
+import contextlib
+import inspect
+import io
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+import numpy as np
+import pandas as pd
+import torch
+
+from .model import MathematicallyCorrectGNNWeightNet
+from .train import train_model
+from .data_utils import period_ptr
+from .telemetry import PeakRSS
+from .shm import WORKER, init_worker, prior_arrays, release, share_arrays, worker_prior
+
+# -----------------------------------------------------------------------------
+# Hyperparameter sweeps / cross-validation in a process pool
+#   - Panel arrays and prior are placed in shared memory once; workers map them
+#     read-only instead of receiving a pickled copy per configuration.
+#   - A configuration's keys go to MathematicallyCorrectGNNWeightNet when they
+#     are constructor arguments, otherwise to train_model.
+# -----------------------------------------------------------------------------
+_MODEL_ARGS = set(inspect.signature(MathematicallyCorrectGNNWeightNet.__init__).parameters) - {"self", "d_in"}
+
+
+def grid(**space):
+    """All combinations of the given value lists: grid(emb=[8, 16], graph_topk=[8, 16])."""
+    keys = list(space)
+    return [dict(zip(keys, vals)) for vals in itertools.product(*(space[k] for k in keys))]
+
+
+def random_space(space, n, seed=0):
+    """
+    n random configurations. Each value in space is a list (uniform choice),
+    a (lo, hi) tuple (uniform float; log-uniform if given as ("log", lo, hi))
+    or a callable taking a numpy Generator.
+    """
+    rng = np.random.default_rng(seed)
+    out = []
+    for _ in range(n):
+        cfg = {}
+        for k, v in space.items():
+            if callable(v):
+                cfg[k] = v(rng)
+            elif isinstance(v, tuple) and v[0] == "log":
+                cfg[k] = float(np.exp(rng.uniform(np.log(v[1]), np.log(v[2]))))
+            elif isinstance(v, tuple):
+                cfg[k] = float(rng.uniform(*v))
+            else:
+                cfg[k] = v[rng.integers(len(v))]
+        out.append(cfg)
+    return out
+
+
+def time_folds(times_sorted, N_per_year, n_folds):
+    """
+    Rolling-origin folds over the last n_folds periods: fold j validates on
+    one of those periods and trains on every earlier period.
+    """
+    ptr = period_ptr(times_sorted, N_per_year)
+    T = len(ptr) - 1
+    if not 1 <= n_folds < T:
+        raise ValueError(f"n_folds must be in [1, {T-1}] for {T} periods")
+    return [dict(train_rows=np.arange(0, ptr[v]), val_rows=np.arange(ptr[v], ptr[v+1]),
+                 test_rows=np.array([], dtype=np.int64))
+            for v in range(T - n_folds, T)]
+
+
+def _warm_up(p):
+    # first-call library setup (allocator pools, kernels) would otherwise be
+    # charged to the first configuration's peak_mem_mb
+    X = np.random.default_rng(0).normal(size=(8, p)).astype(np.float32)
+    with contextlib.redirect_stdout(io.StringIO()):
+        train_model(MathematicallyCorrectGNNWeightNet(p), X, X[:, 0], np.full((8, 8), 1 / 8, np.float32),
+                    np.arange(6), np.arange(6, 8), epochs=2)
+    WORKER["warm"] = True
+
+
+def _run_config(job):
+    cid, fold, cfg, split, train_kwargs, seed, warm_up = job
+    d = WORKER["data"]
+    if warm_up and "warm" not in WORKER:
+        _warm_up(d["X"].shape[1])
+    A = worker_prior()
+    model_kw = {k: v for k, v in cfg.items() if k in _MODEL_ARGS}
+    train_kw = dict(train_kwargs, **{k: v for k, v in cfg.items() if k not in _MODEL_ARGS})
+    row = dict(config_id=cid, fold=fold, **cfg)
+    t0 = time.perf_counter()
+    rss = PeakRSS()
+    try:
+        torch.manual_seed(seed)
+        model = MathematicallyCorrectGNNWeightNet(d["X"].shape[1], **model_kw)
+        with rss, contextlib.redirect_stdout(io.StringIO()):
+            out = train_model(model, d["X"], d["y"], A, split["train_rows"], split.get("val_rows"),
+                              split.get("test_rows"), **train_kw)
+        y_hat = out["y_hat"].detach().cpu().numpy()
+        for part in ("train", "val", "test"):
+            rows = split.get(f"{part}_rows")
+            row[f"rmse_{part}"] = (float(np.sqrt(np.mean((y_hat[rows] - d["y"][rows]) ** 2)))
+                                   if rows is not None and len(rows) else np.nan)
+        row["epochs_run"] = len(out["history"])
+        row["error"] = ""
+    except Exception as e:            # one bad configuration must not end the sweep
+        row["error"] = f"{type(e).__name__}: {e}"
+    row["time_s"] = time.perf_counter() - t0
+    row["peak_mem_mb"] = rss.delta / 2**20
+    return row
+
+
+def run_sweep(
+    configs, X_all, y_all, A_prior, splits,
+    n_workers=None, threads_per_worker=1, seed=0, out_csv=None, mp_context="spawn", warm_up=False,
+    **train_kwargs
+):
+    """
+    Train every configuration on every split in a process pool.
+
+    configs:  list of dicts (see grid / random_space).
+    splits:   one dict with train_rows / val_rows / test_rows (as from
+              split_train_val_test) or a list of them (e.g. time_folds).
+    A_prior:  dense array or scipy sparse prior, shared with the workers.
+    train_kwargs: fixed train_model arguments (epochs, N_per_year, times, ...).
+
+    Each worker uses threads_per_worker torch threads; n_workers defaults to
+    cpu_count // threads_per_worker. Returns one row per (config, fold) with
+    the RMSEs of the final pass, wall time and the peak RSS growth of the
+    worker while training that configuration (MB); written to out_csv if given.
+    The first configuration a worker runs also pays one-time library setup;
+    warm_up=True runs a tiny throwaway training per worker first so that
+    peak_mem_mb is comparable across configurations.
+    """
+    splits = [splits] if isinstance(splits, dict) else list(splits)
+    n_workers = n_workers or max(1, (os.cpu_count() or 1) // threads_per_worker)
+    train_kwargs.setdefault("print_every", 10**9)
+
+    arrays = dict(X=np.asarray(X_all, dtype=np.float32), y=np.asarray(y_all, dtype=np.float32))
+    arrays.update(prior_arrays(A_prior))
+    blocks, specs = share_arrays(arrays)
+
+    jobs = [(cid, fold, cfg, split, train_kwargs, seed + cid, warm_up)
+            for cid, cfg in enumerate(configs) for fold, split in enumerate(splits)]
+    rows = []
+    try:
+        with ProcessPoolExecutor(n_workers, mp_context=get_context(mp_context),
+                                 initializer=init_worker, initargs=(specs, threads_per_worker)) as ex:
+            for fut in as_completed([ex.submit(_run_config, j) for j in jobs]):
+                rows.append(fut.result())
+    finally:
+        release(blocks)
+
+    df = pd.DataFrame(rows).sort_values(["config_id", "fold"]).reset_index(drop=True)
+    if out_csv is not None:
+        df.to_csv(out_csv, index=False)
+    return df
@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+import torch
+
+# -----------------------------------------------------------------------------
+# Training telemetry: per-stage wall clock / peak memory, torch.profiler
+# capture over an epoch window. Stages are also labelled with
+# torch.profiler.record_function, so they show up by name in traces.
+# -----------------------------------------------------------------------------
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")      # 4K on x86, often 16K/64K on arm64
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+class PeakRSS:
+    """Samples the process RSS (Linux /proc) in a thread; peak above the starting RSS, in bytes."""
+    def __init__(self, interval=1e-3):
+        self.interval, self.peak, self.base = interval, 0, 0
+        self._stop = threading.Event()
+
+    @staticmethod
+    def _rss():
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * _PAGE_SIZE
+        except (OSError, IndexError, ValueError):
+            return 0
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._rss())
+            time.sleep(self.interval)
+
+    def reset(self):
+        """Restart the peak from the current RSS, keeping the sampler thread running."""
+        self.base = self.peak = self._rss()
+
+    def sample(self):
+        self.peak = max(self.peak, self._rss())
+        return self.delta
+
+    def __enter__(self):
+        self.reset()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._rss())
+
+    @property
+    def delta(self):
+        return max(self.peak - self.base, 0)
+
+
+class StageTimer:
+    """
+    Accumulates wall time per named stage until pop():
+        with timer("wls"): ...
+    On CUDA the device is synchronised at stage boundaries so kernel time is
+    charged to the right stage. track_memory adds the peak memory of each
+    stage (CUDA allocator peak, or RSS growth on CPU, sampled by one PeakRSS
+    thread that runs from the first stage until pop()).
+    """
+    def __init__(self, device=None, track_memory=False):
+        self.cuda = device is not None and torch.device(device).type == "cuda"
+        self.track_memory = track_memory
+        self.times, self.mem = {}, {}
+        self._rss = None
+
+    @contextmanager
+    def __call__(self, stage):
+        if self.cuda:
+            torch.cuda.synchronize()
+            if self.track_memory:
+                torch.cuda.reset_peak_memory_stats()
+                base = torch.cuda.memory_allocated()
+        if self.track_memory and not self.cuda:
+            if self._rss is None:
+                self._rss = PeakRSS().__enter__()
+            self._rss.reset()
+        t0 = time.perf_counter()
+        try:
+            with torch.profiler.record_function(stage):
+                yield
+        finally:
+            if self.cuda:
+                torch.cuda.synchronize()
+            self.times[stage] = self.times.get(stage, 0.0) + time.perf_counter() - t0
+            if self.track_memory:
+                if self.cuda:
+                    peak = torch.cuda.max_memory_allocated() - base
+                else:
+                    peak = self._rss.sample()
+                self.mem[stage] = max(self.mem.get(stage, 0), peak)
+
+    def pop(self):
+        """Counters since the last pop as history fields (time_<stage>_s, mem_<stage>_mb)."""
+        out = {f"time_{k}_s": v for k, v in self.times.items()}
+        out.update({f"mem_{k}_mb": v / 2**20 for k, v in self.mem.items()})
+        self.times, self.mem = {}, {}
+        if self._rss is not None:
+            self._rss.__exit__(None, None, None)
+            self._rss = None
+        return out
+
+
+class EpochProfiler:
+    """
+    torch.profiler capture for epochs start..stop (inclusive). With
+    trace_dir, a Chrome trace is written there when the window closes;
+    the profile object is kept in .profile for key_averages() etc.
+    """
+    def __init__(self, epochs, trace_dir=None, device=None):
+        self.start, self.stop = epochs
+        self.trace_dir = trace_dir
+        acts = [torch.profiler.ProfilerActivity.CPU]
+        if device is not None and torch.device(device).type == "cuda":
+            acts.append(torch.profiler.ProfilerActivity.CUDA)
+        self._acts = acts
+        self.profile = None
+        self._active = False
+
+    def before(self, ep):
+        if ep == self.start and self.profile is None:
+            self.profile = torch.profiler.profile(activities=self._acts, record_shapes=True, profile_memory=True)
+            self.profile.__enter__()
+            self._active = True
+
+    def after(self, ep):
+        if self._active and ep >= self.stop:
+            self.close()
+
+    def close(self):
+        if not self._active:
+            return
+        self.profile.__exit__(None, None, None)
+        self._active = False
+        if self.trace_dir is not None:
+            os.makedirs(self.trace_dir, exist_ok=True)
+            self.profile.export_chrome_trace(
+                os.path.join(self.trace_dir, f"train_epochs_{self.start}-{self.stop}.json"))
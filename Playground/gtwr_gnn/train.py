@@ -1,116 +1,383 @@
+import os
+import time
 import numpy as np, torch
 import torch.nn.functional as F
 from sklearn.metrics import mean_squared_error
 from .wls import solve_local_wls
 from .kernels import build_spatiotemporal_kernel
+from .data_utils import row_periods
+from .telemetry import StageTimer, EpochProfiler
+from .precision import get_policy, as_storage
+
+
+def _prune_graph(W, graph_topk, graph_symmetrize):
+    """Top-k pruning for the training/eval passes. Without symmetrization the
+    pruned rows go to the solver as neighbour lists (sparse local-WLS)."""
+    from .model import topk_rows, topk_neighbors, symmetrize_rows
+    if graph_symmetrize:
+        if isinstance(W, tuple):
+            raise ValueError("graph_symmetrize needs dense weights; it is not available with sparse_attention")
+        return symmetrize_rows(topk_rows(W, graph_topk))
+    return topk_neighbors(W, graph_topk)
+
+
+def _forward(model, X, A):
+    """Dense forward for a dense prior, edge-restricted forward for (idx, w) neighbour lists."""
+    if isinstance(A, tuple):
+        return model.forward_sparse(X, *A)
+    return model(X, A)
+
+
+def _prior_tensor(A_prior, device):
+    """Dense prior (storage dtype) for the encoder; accepts the CSR output of the kernel builder."""
+    return as_storage(A_prior, device)
+
+
+def _smoothness_operator(A, T, N, sparse=None):
+    """
+    Precompute the coefficient-smoothness penalty over the prior's diagonal
+    (same-period) blocks W_t:  sum_t sum_ij W_t[i,j] ||b_i - b_j||^2.
+    Dense: the graph-Laplacian form  sum_t [sum_i deg_i ||b_i||^2 - 2 tr(B_t^T W_t B_t)]
+           with deg = row + column sums, evaluated in one batched matmul.
+    Sparse (kNN prior, default when the blocks are < 25% dense): edge list.
+    A may also be (idx, w) neighbour lists, which always give the edge list.
+    N: rows per period, or a period_ptr offset array for ragged panels
+       (these always give the edge list).
+    """
+    ragged = np.ndim(N) > 0
+    if isinstance(A, tuple) or ragged:
+        period = torch.as_tensor(row_periods(np.arange(T), N), device=A[0].device if isinstance(A, tuple) else A.device)
+    if isinstance(A, tuple):
+        idx, w = A
+        r = torch.arange(idx.shape[0], device=idx.device).unsqueeze(1).expand_as(idx)
+        keep = (w > 0) & (period[r] == period[idx])
+        return ("sparse", r[keep], idx[keep], w[keep])
+    if ragged:
+        r, c = A.nonzero(as_tuple=True)
+        keep = period[r] == period[c]
+        r, c = r[keep], c[keep]
+        return ("sparse", r, c, A[r, c])
+    blocks = A.reshape(T, N, T, N).diagonal(dim1=0, dim2=2).permute(2, 0, 1)   # (T, N, N)
+    if sparse is None:
+        sparse = bool((blocks != 0).float().mean() < 0.25)
+    if sparse:
+        t, i, j = blocks.nonzero(as_tuple=True)
+        return ("sparse", t * N + i, t * N + j, blocks[t, i, j])
+    blocks = blocks.contiguous()
+    return ("dense", blocks, blocks.sum(dim=2) + blocks.sum(dim=1))
+
+
+def _smoothness(betas, op):
+    if op[0] == "sparse":
+        _, r, c, w = op
+        return torch.sum(w.unsqueeze(1) * (betas[r] - betas[c]).pow(2))
+    _, blocks, deg = op
+    B = betas.reshape(blocks.shape[0], blocks.shape[1], -1)
+    return torch.sum(deg.unsqueeze(-1) * B.pow(2)) - 2.0 * torch.sum(B * torch.bmm(blocks, B))
+
+
+def _train_batches(model, opt, loader, X_t, y_t, graph_topk, wls_kind, ridge_lambda, huber_delta, huber_iters,
+                   ent_w, period, y_pass, timer):
+    """
+    One epoch of mini-batch steps: W rows and local WLS for each batch's
+    targets only. The smoothness penalty is taken over same-period edges
+    between the batch's targets. Fills y_pass[targets]; returns the mean loss.
+    """
+    from .wls import solve_local_rows
+    device = X_t.device
+    losses = []
+    batches = iter(loader)
+    while True:
+        with timer("sample"):
+            b = next(batches, None)
+        if b is None:
+            break
+        nodes = torch.as_tensor(b.nodes, device=device)
+        pos = torch.as_tensor(b.target_pos, device=device)
+        idx = torch.as_tensor(b.nbr_idx, device=device)
+        a = as_storage(b.nbr_prior, device)
+        Xb, yb = X_t[nodes], y_t[nodes]
+
+        opt.zero_grad()
+        with timer("forward"):
+            W, _ = model.forward_sparse(Xb, idx, a, rows=pos)
+        if graph_topk is not None:
+            with timer("topk"):
+                W = _prune_graph(W, graph_topk, False)
+        with timer("wls"):
+            y_hat, betas = solve_local_rows(Xb, yb, W, Xb[pos], kind=wls_kind, ridge=ridge_lambda,
+                                            huber_delta=huber_delta, huber_iters=huber_iters)
+        sup = F.mse_loss(y_hat, yb[pos])
+        ent_loss = -ent_w * _row_entropy(W)
+        spatial_loss = 0.0
+        if period is not None:
+            with timer("smoothness"):
+                # edges target -> neighbour where the neighbour is also a target of this batch
+                tpos = np.full(len(b.nodes), -1)
+                tpos[b.target_pos] = np.arange(len(b.targets))
+                r, j = np.nonzero(b.nbr_prior > 0)
+                c = tpos[b.nbr_idx[r, j]]
+                keep = (c >= 0) & (period[b.targets[r]] == period[b.targets[np.maximum(c, 0)]])
+                if keep.any():
+                    op = ("sparse", torch.as_tensor(r[keep], device=device), torch.as_tensor(c[keep], device=device),
+                          a[r[keep], j[keep]])
+                    spatial_loss = 1e-3 * _smoothness(betas, op)
+
+        total = sup + ent_loss + spatial_loss
+        with timer("backward"):
+            total.backward()
+            torch.nn.utils.clip_grad_norm_(model.parameters(), 1.0)
+            opt.step()
+        losses.append(total.item())
+        y_pass[b.targets] = y_hat.detach().cpu().numpy()
+    return float(np.mean(losses))
+
+
+def _row_entropy(W):
+    """Mean row entropy of W (dense matrix or (idx, w) neighbour lists)."""
+    w = W[1] if isinstance(W, tuple) else W
+    Wn = w / (w.sum(dim=1, keepdims=True) + 1e-12)
+    return -torch.sum(Wn * torch.log(Wn + 1e-12), dim=1).mean()
 
 def train_model(
     model, X_all, y_all, A_prior, train_rows, val_rows=None, test_rows=None,
     epochs=200, lr=1e-3, ridge_lambda=5.0, ent_w=5e-3, smooth_w=1e-3,
     N_per_year=None, times=None, print_every=25, early_stop=True, es_patience=80,
-    wls_kind="ridge", huber_delta=1.0, huber_iters=3, graph_topk=None, graph_symmetrize=False, device=None
+    wls_kind="ridge", huber_delta=1.0, huber_iters=3, graph_topk=None, graph_symmetrize=False, device=None,
+    eval_every=1, eval_reuse=None, eval_on="all", sparse_attention=False,
+    batch_size=None, num_neighbors=None, num_workers=0, seed=0,
+    callbacks=None, track_memory=False, profile_epochs=None, profile_dir=None,
+    checkpoint_dir=None, checkpoint_every=10, resume_from=None
 ):
+    """
+    The model is cast in place to the dtype policy's storage dtype (see
+    precision); inference and artifacts follow the model's parameter dtype.
+
+    N_per_year: rows per period, or the period_ptr offsets of a ragged panel
+                (as returned by build_panel_arrays); used by the smoothness term.
+
+    Evaluation scheduling:
+      eval_every: compute metrics every k epochs (and on the first/last);
+                  early stopping still counts es_patience in epochs.
+      eval_reuse: take metrics from the training pass instead of a second
+                  forward + solve. Default (None): reuse whenever the model
+                  has no dropout/batchnorm, i.e. train and eval passes agree.
+                  Those metrics belong to the pre-step weights, so the
+                  pre-step state is what gets kept as best_state.
+      eval_on:    "all" or "val" (solve only the val rows in the eval pass;
+                  train RMSE then comes from the training pass, test is NaN).
+    sparse_attention: restrict the learned weights to the prior's neighbour
+                  lists (model.forward_sparse); W is then returned as (idx, w).
+
+    Mini-batch (subgraph) training, enabled by batch_size:
+      each step samples batch_size train rows and their prior neighbourhoods
+      (num_neighbors per row, None = all; see sampling.NeighborSampler) and
+      forms W rows and local WLS for those rows only. Implies
+      sparse_attention; eval passes run on the full neighbour lists, and
+      eval_reuse is off. num_workers threads prefetch batches; seed fixes
+      the batch order and neighbour draws. graph_symmetrize is not available.
+
+    Telemetry:
+      every history entry carries time_epoch_s and time_<stage>_s for the
+      stages forward, topk, wls, smoothness, backward, eval (and sample in
+      mini-batch mode); track_memory adds mem_<stage>_mb (stage peak).
+      callbacks: callables cb(epoch, record, model) run after each epoch's
+                  history entry; returning True stops training.
+      profile_epochs=(start, stop): torch.profiler capture over those epochs,
+                  returned as out["profile"]; Chrome trace in profile_dir.
+
+    Checkpointing (see artifacts.save_checkpoint):
+      checkpoint_dir: write model, optimizer and early-stopping state there
+                  every checkpoint_every epochs and on the epoch training stops.
+      resume_from: continue from such a checkpoint; epochs is the total, so
+                  the run picks up at the checkpoint's epoch + 1.
+    """
     device = device or (next(model.parameters()).device)
-    X_t = torch.tensor(X_all, dtype=torch.float32, device=device)
-    y_t = torch.tensor(y_all, dtype=torch.float32, device=device)
-    A_t = torch.tensor(A_prior, dtype=torch.float32, device=device)
+    model.to(dtype=get_policy().storage)
+    X_t, y_t = as_storage(X_all, device), as_storage(y_all, device)
+    loader = None
+    if batch_size is not None:
+        if graph_symmetrize:
+            raise ValueError("graph_symmetrize is not available with batch_size")
+        from .sampling import NeighborSampler, BatchLoader
+        sparse_attention, eval_reuse = True, False
+    if sparse_attention:
+        from .model import prior_neighbors
+        A_t = prior_neighbors(A_prior, device=device)
+        if batch_size is not None:
+            sampler = NeighborSampler(A_t[0].cpu().numpy(), A_t[1].cpu().numpy(), num_neighbors)
+            loader = BatchLoader(sampler, train_rows, batch_size, num_workers=num_workers, seed=seed)
+    else:
+        A_t = _prior_tensor(A_prior, device)
 
     opt = torch.optim.Adam(model.parameters(), lr=lr, weight_decay=1e-4)
-    best_val, best_state, patience = float('inf'), None, 0
+    best_val, best_state, best_ep = float('inf'), None, 0
     hist = []
+    if eval_reuse is None:
+        eval_reuse = not any(isinstance(m, (torch.nn.Dropout, torch.nn.modules.batchnorm._BatchNorm))
+                             for m in model.modules())
+    has_val = val_rows is not None and len(val_rows) > 0
+    has_test = test_rows is not None and len(test_rows) > 0
 
     T = len(times) if times is not None else None
+    smooth_op = _smoothness_operator(A_t, T, N_per_year) if (T is not None and N_per_year is not None) else None
+    timer = StageTimer(device, track_memory)
+    profiler = EpochProfiler(profile_epochs, profile_dir, device) if profile_epochs is not None else None
+    callbacks = list(callbacks or [])
 
-    for ep in range(1, epochs+1):
-        model.train(); opt.zero_grad()
+    start_ep = 1
+    if resume_from is not None:
+        from .artifacts import load_checkpoint
+        ck = load_checkpoint(resume_from, model, opt, device)
+        start_ep, hist = ck["epoch"] + 1, ck["history"]
+        best_val, best_ep, best_state = ck["best_val"], ck["best_ep"], ck["best_state"]
+        if loader is not None:
+            loader.epoch = ck["epoch"]
+    if checkpoint_dir is not None:
+        from .artifacts import save_checkpoint
+        def _checkpoint(ep, record, model):
+            if ep % checkpoint_every == 0 or ep == epochs:
+                save_checkpoint(checkpoint_dir, model, opt, ep, hist, best_state, best_val, best_ep)
+        callbacks.append(_checkpoint)
 
-        W, B = model(X_t, A_t)
-        if graph_topk is not None:
-            from .model import topk_rows, symmetrize_rows
-            W = topk_rows(W, graph_topk)
-            if graph_symmetrize:
-                W = symmetrize_rows(W)
+    stop = None
+    for ep in range(start_ep, epochs+1):
+        if profiler is not None:
+            profiler.before(ep)
+        t_epoch = time.perf_counter()
+        is_eval = (ep % eval_every == 0) or (ep == 1) or (ep == epochs)
+        model.train()
+        if loader is not None:
+            y_train_pass = np.full(len(y_all), np.nan, dtype=np.float32)
+            total = torch.tensor(_train_batches(model, opt, loader, X_t, y_t, graph_topk, wls_kind, ridge_lambda,
+                                                huber_delta, huber_iters, ent_w,
+                                                row_periods(times, N_per_year) if smooth_op is not None else None,
+                                                y_train_pass, timer))
+        else:
+            opt.zero_grad()
 
-        y_hat, betas = solve_local_wls(
-            X_t, y_t, W, kind=wls_kind, ridge=ridge_lambda,
-            huber_delta=huber_delta, huber_iters=huber_iters, return_betas=True
-        )
+            with timer("forward"):
+                W, B = _forward(model, X_t, A_t)
+            if graph_topk is not None:
+                with timer("topk"):
+                    W = _prune_graph(W, graph_topk, graph_symmetrize)
 
-        sup = F.mse_loss(y_hat[train_rows], y_t[train_rows])
+            with timer("wls"):
+                y_hat, betas = solve_local_wls(
+                    X_t, y_t, W, kind=wls_kind, ridge=ridge_lambda,
+                    huber_delta=huber_delta, huber_iters=huber_iters, return_betas=True
+                )
 
-        Wn = W / (W.sum(dim=1, keepdims=True) + 1e-12)
-        ent = -torch.sum(Wn * torch.log(Wn + 1e-12), dim=1).mean()
-        ent_loss = -ent_w * ent
+            sup = F.mse_loss(y_hat[train_rows], y_t[train_rows])
 
-        if (T is not None) and (N_per_year is not None):
-            smooth = 0.0
-            beta_mat = betas.reshape(T, N_per_year, -1)
-            for t_idx in range(T):
-                bt = beta_mat[t_idx]
-                s, e = t_idx*N_per_year, (t_idx+1)*N_per_year
-                Wsp = A_t[s:e, s:e]
-                diff = bt.unsqueeze(1) - bt.unsqueeze(0)
-                smooth = smooth + torch.sum(Wsp.unsqueeze(-1) * diff.pow(2))
-            spatial_loss = 1e-3 * smooth
-        else:
-            spatial_loss = 0.0
+            ent = _row_entropy(W)
+            ent_loss = -ent_w * ent
 
-        total = sup + ent_loss + spatial_loss
-        total.backward()
-        torch.nn.utils.clip_grad_norm_(model.parameters(), 1.0)
-        opt.step()
+            if smooth_op is not None:
+                with timer("smoothness"):
+                    spatial_loss = 1e-3 * _smoothness(betas, smooth_op)
+            else:
+                spatial_loss = 0.0
+
+            total = sup + ent_loss + spatial_loss
+            with timer("backward"):
+                total.backward()
+                torch.nn.utils.clip_grad_norm_(model.parameters(), 1.0)
+                if eval_reuse and is_eval:
+                    pre_state = {k: v.detach().cpu().clone() for k,v in model.state_dict().items()}
+                opt.step()
+
+        if not is_eval:
+            hist.append(dict(epoch=ep, loss=total.item(), rmse_tr=np.nan, rmse_va=np.nan, rmse_te=np.nan,
+                             alpha=float(model.alpha), tau=float(model.tau),
+                             time_epoch_s=time.perf_counter() - t_epoch, **timer.pop()))
+            if profiler is not None:
+                profiler.after(ep)
+            if any([cb(ep, hist[-1], model) for cb in callbacks]):
+                stop = f"Stopped by callback at epoch {ep}"
+                print(stop)
+                break
+            continue
 
         # Eval
-        model.eval()
-        with torch.no_grad():
-            W_eval, _ = model(X_t, A_t)
-            if graph_topk is not None:
-                from .model import topk_rows, symmetrize_rows
-                W_eval = topk_rows(W_eval, graph_topk)
-                if graph_symmetrize:
-                    W_eval = symmetrize_rows(W_eval)
-            y_eval = solve_local_wls(X_t, y_t, W_eval, kind=wls_kind, ridge=ridge_lambda, return_betas=False)
-            rmse_tr = np.sqrt(mean_squared_error(y_all[train_rows], y_eval[train_rows].detach().cpu().numpy()))
-            rmse_va = np.sqrt(mean_squared_error(y_all[val_rows],   y_eval[val_rows].detach().cpu().numpy())) if val_rows is not None and len(val_rows)>0 else float('inf')
-            rmse_te = np.sqrt(mean_squared_error(y_all[test_rows],  y_eval[test_rows].detach().cpu().numpy()))  if test_rows is not None and len(test_rows)>0 else np.nan
+        if loader is None:
+            y_train_pass = y_hat.detach().cpu().numpy()
+        rmse_te = np.nan
+        if eval_reuse:
+            y_eval = y_train_pass
+        else:
+            model.eval()
+            with torch.no_grad(), timer("eval"):
+                W_eval, _ = _forward(model, X_t, A_t)
+                if graph_topk is not None:
+                    W_eval = _prune_graph(W_eval, graph_topk, graph_symmetrize)
+                if eval_on == "val" and has_val:
+                    y_eval = np.full(len(y_all), np.nan, dtype=np.float32)
+                    y_eval[val_rows] = solve_local_wls(X_t, y_t, W_eval, kind=wls_kind, ridge=ridge_lambda,
+                                                       return_betas=False, rows=val_rows).cpu().numpy()
+                else:
+                    y_eval = solve_local_wls(X_t, y_t, W_eval, kind=wls_kind, ridge=ridge_lambda,
+                                             return_betas=False).cpu().numpy()
+        eval_all = eval_reuse or eval_on != "val" or not has_val
+        rmse_tr = np.sqrt(mean_squared_error(y_all[train_rows], (y_eval if eval_all else y_train_pass)[train_rows]))
+        rmse_va = np.sqrt(mean_squared_error(y_all[val_rows], y_eval[val_rows])) if has_val else float('inf')
+        if has_test and eval_all:
+            rmse_te = np.sqrt(mean_squared_error(y_all[test_rows], y_eval[test_rows]))
 
         hist.append(dict(epoch=ep, loss=total.item(), rmse_tr=rmse_tr, rmse_va=rmse_va, rmse_te=rmse_te,
-                         alpha=float(model.alpha), tau=float(model.tau)))
+                         alpha=float(model.alpha), tau=float(model.tau),
+                         time_epoch_s=time.perf_counter() - t_epoch, **timer.pop()))
+        if profiler is not None:
+            profiler.after(ep)
         if (ep % print_every == 0) or (ep == 1):
             print(f"Epoch {ep:3d} | Loss {total.item():.4f} | RMSE: Train {rmse_tr:.3f} | Val {rmse_va:.3f} | α {float(model.alpha):.3f} | τ {float(model.tau):.3f}")
 
-        score = rmse_va if val_rows is not None and len(val_rows)>0 else rmse_tr
+        score = rmse_va if has_val else rmse_tr
         if score < best_val - 1e-6:
-            best_val, best_state, patience = score, {k: v.detach().cpu().clone() for k,v in model.state_dict().items()}, 0
-        else:
-            patience += 1
-            if early_stop and patience >= es_patience:
-                print(f"Early stopping at epoch {ep}")
-                break
+            best_val, best_ep = score, ep
+            best_state = pre_state if eval_reuse else {k: v.detach().cpu().clone() for k,v in model.state_dict().items()}
+        elif early_stop and ep - best_ep >= es_patience:
+            stop = f"Early stopping at epoch {ep}"
+        # callbacks (and checkpoints) also see the epoch training stops on
+        if any([cb(ep, hist[-1], model) for cb in callbacks]):
+            stop = f"Stopped by callback at epoch {ep}"
+        if stop:
+            print(stop)
+            break
 
+    if stop and checkpoint_dir is not None and ep % checkpoint_every != 0:
+        save_checkpoint(checkpoint_dir, model, opt, ep, hist, best_state, best_val, best_ep)
+    if profiler is not None:
+        profiler.close()
     if best_state is not None:
         model.load_state_dict({k: v.to(device) for k,v in best_state.items()})
 
     # final forward
     model.eval()
     with torch.no_grad():
-        W_final, _ = model(X_t, A_t)
+        W_final, _ = _forward(model, X_t, A_t)
         if graph_topk is not None:
             from .model import topk_rows, symmetrize_rows
-            W_final = topk_rows(W_final, graph_topk)
-            if graph_symmetrize:
-                W_final = symmetrize_rows(W_final)
+            if isinstance(W_final, tuple):
+                W_final = _prune_graph(W_final, graph_topk, graph_symmetrize)
+            else:
+                W_final = topk_rows(W_final, graph_topk)
+                if graph_symmetrize:
+                    W_final = symmetrize_rows(W_final)
         y_final, betas_final = solve_local_wls(X_t, y_t, W_final, kind=wls_kind, ridge=ridge_lambda, return_betas=True)
 
-    return dict(W=W_final, y_hat=y_final, betas=betas_final, history=hist, best_state=best_state)
+    return dict(W=W_final, y_hat=y_final, betas=betas_final, history=hist, best_state=best_state,
+                profile=profiler.profile if profiler is not None else None)
 
 
 # -----------------------------------------------------------------------------
 # Fine-tune TRANSDUCTIVE with FUTURE year in graph (labels masked)
 #   - Build prior on (2019..future_year) panel
-#   - Warm-start from a trained model (recommended)
+#   - Warm-start from a trained model (recommended) or an artifact path
 #   - Optimize only on train_rows (past years); val_rows optional; future_rows masked
 #   - Return final predictions including FUTURE year (transductive)
+#   - sparse_attention: forward on the prior's neighbour lists, as in
+#     train_model, so no (NT, NT) tensor is formed; W and A_prior are (idx, w)
 # -----------------------------------------------------------------------------
 def finetune_transductive_with_future(
     model, X_all_full, y_all_full, coords_blocks_full, times_full,
@@ -119,20 +386,29 @@ def finetune_transductive_with_future(
     knn_k=8, tau_s=1.0, tau_t=1.0, prior_self_weight=1.0,
     N_per_year=None, print_every=25, patience=40,
     wls_kind="ridge", huber_delta=1.0, huber_iters=3, graph_topk=None, graph_symmetrize=False,
-    device=None
+    device=None, cache=None, sparse_attention=False
 ):
+    if isinstance(model, (str, os.PathLike)):      # warm start from a saved artifact
+        from .artifacts import load_artifact
+        model = load_artifact(model, device=device).model
     device = device or (next(model.parameters()).device)
     # Build prior on full panel
     A_prior_np = build_spatiotemporal_kernel(coords_blocks_full, times_full,
                                              tau_s=tau_s, tau_t=tau_t, k_neighbors=knn_k,
-                                             prior_self_weight=prior_self_weight, verbose=False)
-    A = torch.tensor(A_prior_np, dtype=torch.float32, device=device)
-    X = torch.tensor(X_all_full, dtype=torch.float32, device=device)
-    y = torch.tensor(y_all_full, dtype=torch.float32, device=device)
+                                             prior_self_weight=prior_self_weight, verbose=False,
+                                             return_sparse=True, cache=cache)
+    model.to(dtype=get_policy().storage)          # in place, as in train_model
+    if sparse_attention:
+        from .model import prior_neighbors
+        A = prior_neighbors(A_prior_np, device=device)
+    else:
+        A = _prior_tensor(A_prior_np, device)
+    X, y = as_storage(X_all_full, device), as_storage(y_all_full, device)
 
     opt = torch.optim.Adam(model.parameters(), lr=lr, weight_decay=1e-4)
     best_val, best_state, pat = float('inf'), None, 0
     T = len(times_full)
+    smooth_op = _smoothness_operator(A, T, N_per_year) if N_per_year is not None else None
 
     mask_train = torch.zeros(X.shape[0], dtype=torch.bool, device=device); mask_train[train_rows] = True
     mask_val   = torch.zeros_like(mask_train);                                  mask_val[val_rows]   = True
@@ -141,30 +417,18 @@ def finetune_transductive_with_future(
 
     for ep in range(1, epochs+1):
         model.train(); opt.zero_grad()
-        W, B = model(X, A)
+        W, B = _forward(model, X, A)
         if graph_topk is not None:
-            from .model import topk_rows, symmetrize_rows
-            W = topk_rows(W, graph_topk)
-            if graph_symmetrize:
-                W = symmetrize_rows(W)
+            W = _prune_graph(W, graph_topk, graph_symmetrize)
 
         y_hat, betas = solve_local_wls(X, y, W, kind=wls_kind, ridge=ridge_lambda,
                                        huber_delta=huber_delta, huber_iters=huber_iters, return_betas=True)
         sup = F.mse_loss(y_hat[mask_train], y[mask_train])
 
-        Wn = W / (W.sum(dim=1, keepdims=True) + 1e-12)
-        ent = -torch.sum(Wn * torch.log(Wn + 1e-12), dim=1).mean()
+        ent = _row_entropy(W)
         ent_loss = -ent_w * ent
 
-        smooth = 0.0
-        if (N_per_year is not None) and (T is not None):
-            beta_mat = betas.reshape(T, N_per_year, -1)
-            for t_idx in range(T):
-                bt = beta_mat[t_idx]
-                s, e = t_idx*N_per_year, (t_idx+1)*N_per_year
-                Wsp = A[s:e, s:e]
-                diff = bt.unsqueeze(1) - bt.unsqueeze(0)
-                smooth = smooth + torch.sum(Wsp.unsqueeze(-1) * diff.pow(2))
+        smooth = _smoothness(betas, smooth_op) if smooth_op is not None else 0.0
         spatial_loss = smooth_w * smooth
 
         total = sup + ent_loss + spatial_loss
@@ -173,12 +437,9 @@ def finetune_transductive_with_future(
         # eval
         model.eval()
         with torch.no_grad():
-            W_eval, _ = model(X, A)
+            W_eval, _ = _forward(model, X, A)
             if graph_topk is not None:
-                from .model import topk_rows, symmetrize_rows
-                W_eval = topk_rows(W_eval, graph_topk)
-                if graph_symmetrize:
-                    W_eval = symmetrize_rows(W_eval)
+                W_eval = _prune_graph(W_eval, graph_topk, graph_symmetrize)
             y_eval = solve_local_wls(X, y, W_eval, kind=wls_kind, ridge=ridge_lambda, return_betas=False)
             import numpy as np
             from sklearn.metrics import mean_squared_error
@@ -203,12 +464,14 @@ def finetune_transductive_with_future(
     # final
     model.eval()
     with torch.no_grad():
-        W_fin, _ = model(X, A)
-        if graph_topk is not None:
+        W_fin, _ = _forward(model, X, A)
+        if graph_topk is not None and sparse_attention:
+            W_fin = _prune_graph(W_fin, graph_topk, graph_symmetrize)
+        elif graph_topk is not None:
             from .model import topk_rows, symmetrize_rows
             W_fin = topk_rows(W_fin, graph_topk)
             if graph_symmetrize:
                 W_fin = symmetrize_rows(W_fin)
         y_fin, betas_fin = solve_local_wls(X, y, W_fin, kind=wls_kind, ridge=ridge_lambda, return_betas=True)
 
-    return dict(W=W_fin, y_hat=y_fin, betas=betas_fin, best_state=best_state, A_prior=A, X=X, y=y)
+    return dict(W=W_fin, y_hat=y_fin, betas=betas_fin, best_state=best_state, A_prior=A, X=X, y=y, model=model)
@@ -1,57 +1,304 @@
-
 import torch
 import torch.nn.functional as F
+from .precision import get_policy
 
-def local_wls_ridge(X, y, W, ridge=5.0, return_betas=True):
+# -----------------------------------------------------------------------------
+# Batched engine: all N local systems are formed and solved at once.
+#   XtWX[k] = sum_n W[k,n] x_n x_n^T + ridge*I   -> one (N,N)@(N,p*p) matmul
+#   XtWy[k] = sum_n W[k,n] x_n y_n               -> one (N,N)@(N,p) matmul
+# -----------------------------------------------------------------------------
+def _normal_equations(X, y, W, ridge, eps=1e-12):
     N, p = X.shape
-    device = X.device
-    I = ridge * torch.eye(p, device=device)
-    y_hat = torch.zeros(N, device=device)
-    betas = torch.zeros(N, p, device=device) if return_betas else None
-    for i in range(N):
-        w = W[i]
-        ws = torch.sqrt(w + 1e-12)
-        Xw = X * ws.unsqueeze(1); yw = y * ws
-        XtWX = Xw.t() @ Xw + I
-        XtWy = Xw.t() @ yw
-        try:
-            beta = torch.linalg.solve(XtWX, XtWy)
-        except RuntimeError:
-            beta = torch.linalg.lstsq(XtWX, XtWy.unsqueeze(1)).solution.squeeze()
-        y_hat[i] = X[i] @ beta
-        if return_betas: betas[i] = beta
+    XX = (X.unsqueeze(2) * X.unsqueeze(1)).reshape(N, p * p)   # outer products x_n x_n^T
+    Xy = X * y.unsqueeze(1)
+    # eps on every weight (as sqrt(w + eps) did per row) without copying W
+    XtWX = (W @ XX + eps * XX.sum(0)).reshape(-1, p, p)
+    XtWX = XtWX + ridge * torch.eye(p, device=X.device, dtype=X.dtype)
+    XtWy = W @ Xy + eps * Xy.sum(0)
+    return XtWX, XtWy
+
+def _batched_solve(A, b):
+    """Batched Cholesky solve of A[k] beta[k] = b[k]; rows that fail fall back to lstsq.
+    Factorises in the dtype policy's solve dtype, returns the input dtype."""
+    solve = get_policy().solve_dtype(A.dtype)
+    if solve != A.dtype:
+        return _batched_solve(A.to(solve), b.to(solve)).to(A.dtype)
+    L, info = torch.linalg.cholesky_ex(A)
+    bad = info != 0
+    if not bool(bad.any()):
+        return torch.cholesky_solve(b.unsqueeze(-1), L).squeeze(-1)
+    # ill-conditioned rows: factor an identity in their place, then overwrite with lstsq
+    eye = torch.eye(A.shape[-1], device=A.device, dtype=A.dtype).expand_as(A)
+    L = torch.linalg.cholesky(torch.where(bad[:, None, None], eye, A))
+    beta = torch.cholesky_solve(b.unsqueeze(-1), L).squeeze(-1)
+    idx = bad.nonzero().squeeze(1)
+    sol = torch.linalg.lstsq(A[idx], b[idx].unsqueeze(-1)).solution.squeeze(-1)
+    return beta.index_put((idx,), sol)
+
+# -----------------------------------------------------------------------------
+# Implicit backward for the ridge solve.  With A_k beta_k = b_k,
+#   A_k = sum_n W[k,n] x_n x_n^T + ridge*I,  b_k = sum_n W[k,n] x_n y_n,
+# and u_k = A_k^{-1} dL/dbeta_k (one batched solve with the forward's
+# Cholesky factors):
+#   dL/dW[k,n] = (u_k . x_n) * (y_n - beta_k . x_n)
+#              = [u_k, -vec(u_k beta_k^T)] . [x_n y_n, vec(x_n x_n^T)]
+# The second form is one (m, p+p^2) @ (p+p^2, N) matmul, so the gradient is
+# the only (m, N) tensor backward allocates. Only L and beta are kept for
+# backward; the normal equations and the solves are not recorded by autograd.
+# -----------------------------------------------------------------------------
+def _factor(A, b):
+    """Cholesky-solve A beta = b. Returns (beta, L, bad, A_bad); bad rows use lstsq.
+    L and A_bad are in the policy's solve dtype, beta in the input dtype."""
+    solve = get_policy().solve_dtype(A.dtype)
+    if solve != A.dtype:
+        beta, L, bad, A_bad = _factor(A.to(solve), b.to(solve))
+        return beta.to(A.dtype), L, bad, A_bad
+    L, info = torch.linalg.cholesky_ex(A)
+    bad = (info != 0).nonzero().squeeze(1)
+    if bad.numel() == 0:
+        return torch.cholesky_solve(b.unsqueeze(-1), L).squeeze(-1), L, bad, None
+    eye = torch.eye(A.shape[-1], device=A.device, dtype=A.dtype)
+    L = L.index_put((bad,), torch.linalg.cholesky(eye.expand(bad.numel(), -1, -1).contiguous()))
+    beta = torch.cholesky_solve(b.unsqueeze(-1), L).squeeze(-1)
+    A_bad = A[bad]
+    return beta.index_put((bad,), torch.linalg.lstsq(A_bad, b[bad].unsqueeze(-1)).solution.squeeze(-1)), L, bad, A_bad
+
+def _adjoint(g, L, bad, A_bad):
+    dtype, g = g.dtype, g.to(L.dtype)
+    u = torch.cholesky_solve(g.unsqueeze(-1), L).squeeze(-1)
+    if bad.numel():
+        u = u.index_put((bad,), torch.linalg.lstsq(A_bad.transpose(1, 2), g[bad].unsqueeze(-1)).solution.squeeze(-1))
+    return u.to(dtype)
+
+class _RidgeSolve(torch.autograd.Function):
+    """Dense W (m, N) -> betas (m, p); gradient w.r.t. W only."""
+    @staticmethod
+    def forward(ctx, X, y, W, ridge):
+        XtWX, XtWy = _normal_equations(X, y, W, ridge)
+        beta, L, bad, A_bad = _factor(XtWX, XtWy)
+        ctx.save_for_backward(X, y, beta, L, bad, A_bad if A_bad is not None else torch.empty(0))
+        return beta
+
+    @staticmethod
+    @torch.autograd.function.once_differentiable
+    def backward(ctx, g):
+        X, y, beta, L, bad, A_bad = ctx.saved_tensors
+        u = _adjoint(g, L, bad, A_bad)
+        N, p = X.shape
+        left = torch.cat([u, -(u.unsqueeze(2) * beta.unsqueeze(1)).reshape(-1, p * p)], 1)
+        right = torch.cat([X * y.unsqueeze(1), (X.unsqueeze(2) * X.unsqueeze(1)).reshape(N, p * p)], 1)
+        return None, None, left @ right.t(), None
+
+class _RidgeSolveSparse(torch.autograd.Function):
+    """Neighbour lists (idx, w) (m, k) -> betas (m, p); gradient w.r.t. w only."""
+    @staticmethod
+    def forward(ctx, X, y, idx, w, ridge):
+        beta, L, bad, A_bad = _factor(*_neighbor_normal_equations(X, y, idx, w, ridge))
+        ctx.save_for_backward(X, y, idx, beta, L, bad, A_bad if A_bad is not None else torch.empty(0))
+        return beta
+
+    @staticmethod
+    @torch.autograd.function.once_differentiable
+    def backward(ctx, g):
+        X, y, idx, beta, L, bad, A_bad = ctx.saved_tensors
+        u = _adjoint(g, L, bad, A_bad)
+        Xn = X[idx]                                               # (m, k, p), rebuilt rather than saved
+        gw = (Xn @ u.unsqueeze(2)).squeeze(2) * (y[idx] - (Xn @ beta.unsqueeze(2)).squeeze(2))
+        return None, None, None, gw, None
+
+def _implicit(X, y, w):
+    """Use the implicit backward when only the weights need gradients."""
+    return torch.is_grad_enabled() and w.requires_grad and not (X.requires_grad or y.requires_grad)
+
+# -----------------------------------------------------------------------------
+# Sparse engine: W given as padded neighbour lists (idx, w), both (N, k).
+#   Row i's system only touches X[idx[i]] -> O(N*k*p^2) instead of O(N^2*p).
+#   Padding slots carry w = 0 (any index).
+# -----------------------------------------------------------------------------
+def is_neighbors(W):
+    return isinstance(W, (tuple, list)) and len(W) == 2
+
+def as_neighbors(W):
+    """Convert a torch sparse (COO/CSR) matrix to padded neighbour lists (idx, w)."""
+    if is_neighbors(W):
+        return W
+    if W.layout == torch.strided:
+        return dense_to_neighbors(W)
+    coo = W.to_sparse_coo().coalesce()
+    rows, cols = coo.indices()
+    vals = coo.values()
+    N = W.shape[0]
+    counts = torch.bincount(rows, minlength=N)
+    k = max(int(counts.max()) if counts.numel() else 0, 1)
+    ptr = torch.cumsum(counts, 0) - counts
+    pos = torch.arange(rows.numel(), device=rows.device) - ptr[rows]
+    idx = torch.zeros((N, k), dtype=torch.long, device=rows.device)
+    idx[rows, pos] = cols
+    w = torch.zeros((N, k), dtype=vals.dtype, device=vals.device).index_put((rows, pos), vals)
+    return idx, w
+
+def dense_to_neighbors(W, k=None):
+    """Keep the k largest entries per row of a dense W (default: max nonzeros per row)."""
+    if k is None:
+        k = int((W != 0).sum(dim=1).max())
+    k = max(1, min(int(k), W.shape[1]))
+    w, idx = torch.topk(W, k, dim=1)
+    return idx, w
+
+def _neighbor_normal_equations(X, y, idx, w, ridge):
+    p = X.shape[1]
+    Xn = X[idx]                                    # (N, k, p)
+    Xw = Xn * w.unsqueeze(2)
+    XtWX = Xw.transpose(1, 2) @ Xn + ridge * torch.eye(p, device=X.device, dtype=X.dtype)
+    XtWy = (Xw * y[idx].unsqueeze(2)).sum(dim=1)
+    return XtWX, XtWy
+
+def _fit_ridge_sparse(X, y, idx, w, ridge):
+    if _implicit(X, y, w):
+        return _RidgeSolveSparse.apply(X, y, idx, w, ridge)
+    XtWX, XtWy = _neighbor_normal_equations(X, y, idx, w, ridge)
+    return _batched_solve(XtWX, XtWy)
+
+def _huber_weights(r, delta):
+    absr = torch.abs(r) + 1e-12
+    return torch.where(absr <= delta, torch.ones_like(absr), (delta / absr))
+
+def _converged(new, old, tol):
+    """Rows whose coefficients moved by at most tol (relative to their scale)."""
+    step = (new - old).detach().abs().amax(dim=1)
+    return step <= tol * (1.0 + old.detach().abs().amax(dim=1))
+
+# -----------------------------------------------------------------------------
+# Huber IRLS, all rows at once: iteration 1 is the plain weighted fit, each
+# further iteration reweights by the Huber weights of the current residuals.
+# With tol, rows that have converged drop out of the active set, so later
+# iterations only form and solve the systems that are still moving.
+# -----------------------------------------------------------------------------
+def _fit_huber_sparse(X, y, idx, w, ridge, delta, iters, tol=None):
+    betas = _fit_ridge_sparse(X, y, idx, w, ridge)
+    act = torch.arange(idx.shape[0], device=idx.device)
+    for _ in range(iters - 1):
+        ia, b = idx[act], betas[act]
+        r = y[ia] - (X[ia] @ b.unsqueeze(2)).squeeze(2)   # residuals on each row's support only
+        wc = w[act] * _huber_weights(r, delta)
+        new = _batched_solve(*_neighbor_normal_equations(X, y, ia, wc, ridge))
+        betas = betas.index_put((act,), new)
+        if tol is not None:
+            act = act[~_converged(new, b, tol)]
+            if act.numel() == 0:
+                break
+    return betas
+
+def local_wls_ridge_sparse(X, y, idx, w, ridge=5.0, return_betas=True, rows=None):
+    if rows is not None:
+        idx, w = idx[rows], w[rows]
+    betas = _fit_ridge_sparse(X, y, idx, w, ridge)
+    y_hat = ((X if rows is None else X[rows]) * betas).sum(dim=1)
     return (y_hat, betas) if return_betas else y_hat
 
-def local_wls_huber(X, y, W, ridge=5.0, delta=1.0, iters=3, return_betas=True):
-    N, p = X.shape
-    device = X.device
-    I = ridge * torch.eye(p, device=device)
-    y_hat = torch.zeros(N, device=device)
-    betas = torch.zeros(N, p, device=device) if return_betas else None
-    for i in range(N):
-        w = W[i].clone()
-        beta = None
-        for _ in range(iters):
-            ws = torch.sqrt(w + 1e-12)
-            Xw = X * ws.unsqueeze(1); yw = y * ws
-            XtWX = Xw.t() @ Xw + I
-            XtWy = Xw.t() @ yw
-            try:
-                beta = torch.linalg.solve(XtWX, XtWy)
-            except RuntimeError:
-                beta = torch.linalg.lstsq(XtWX, XtWy.unsqueeze(1)).solution.squeeze()
-            r = y - X @ beta
-            absr = torch.abs(r) + 1e-12
-            # Huber weight update (IRLS style)
-            w = W[i] * torch.where(absr <= delta, torch.ones_like(absr), (delta / absr))
-        y_hat[i] = X[i] @ beta
-        if return_betas: betas[i] = beta
+def local_wls_huber_sparse(X, y, idx, w, ridge=5.0, delta=1.0, iters=3, return_betas=True, rows=None, tol=1e-6):
+    if rows is not None:
+        idx, w = idx[rows], w[rows]
+    betas = _fit_huber_sparse(X, y, idx, w, ridge, delta, iters, tol)
+    y_hat = ((X if rows is None else X[rows]) * betas).sum(dim=1)
+    return (y_hat, betas) if return_betas else y_hat
+
+def _fit_ridge(X, y, W, ridge):
+    if _implicit(X, y, W):
+        return _RidgeSolve.apply(X, y, W, ridge)
+    XtWX, XtWy = _normal_equations(X, y, W, ridge)
+    return _batched_solve(XtWX, XtWy)
+
+def _fit_huber(X, y, W, ridge, delta, iters, tol=None):
+    betas = _fit_ridge(X, y, W, ridge)
+    act = torch.arange(W.shape[0], device=W.device)
+    for _ in range(iters - 1):
+        b = betas[act]
+        R = y.unsqueeze(0) - b @ X.t()              # (m, N): row k's residuals at every point
+        # Huber weight update (IRLS style)
+        w = W[act] * _huber_weights(R, delta)
+        new = _batched_solve(*_normal_equations(X, y, w, ridge))
+        betas = betas.index_put((act,), new)
+        if tol is not None:
+            act = act[~_converged(new, b, tol)]
+            if act.numel() == 0:
+                break
+    return betas
+
+def local_wls_ridge(X, y, W, ridge=5.0, return_betas=True, rows=None):
+    if rows is not None:
+        W = W[rows]
+    betas = _fit_ridge(X, y, W, ridge)
+    y_hat = ((X if rows is None else X[rows]) * betas).sum(dim=1)
+    return (y_hat, betas) if return_betas else y_hat
+
+def local_wls_huber(X, y, W, ridge=5.0, delta=1.0, iters=3, return_betas=True, rows=None, tol=1e-6):
+    if rows is not None:
+        W = W[rows]
+    betas = _fit_huber(X, y, W, ridge, delta, iters, tol)
+    y_hat = ((X if rows is None else X[rows]) * betas).sum(dim=1)
+    return (y_hat, betas) if return_betas else y_hat
+
+def solve_local_rows(X, y, W_rows, X_rows, kind="ridge", ridge=5.0, huber_delta=1.0, huber_iters=3,
+                     return_betas=True, huber_tol=1e-6):
+    """
+    Local WLS at arbitrary query points: row m of W_rows (dense (M, N) or
+    (idx, w) neighbour lists over the N design rows of X, y) defines one
+    local system, and its fit is evaluated at X_rows[m].
+    """
+    if is_neighbors(W_rows):
+        idx, w = W_rows
+        if kind == "ridge":
+            betas = _fit_ridge_sparse(X, y, idx, w, ridge)
+        elif kind == "huber":
+            betas = _fit_huber_sparse(X, y, idx, w, ridge, huber_delta, huber_iters, huber_tol)
+        else:
+            raise ValueError(f"Unknown WLS kind: {kind}")
+    elif kind == "ridge":
+        betas = _fit_ridge(X, y, W_rows, ridge)
+    elif kind == "huber":
+        betas = _fit_huber(X, y, W_rows, ridge, huber_delta, huber_iters, huber_tol)
+    else:
+        raise ValueError(f"Unknown WLS kind: {kind}")
+    y_hat = (X_rows * betas).sum(dim=1)
     return (y_hat, betas) if return_betas else y_hat
 
-def solve_local_wls(X, y, W, kind="ridge", ridge=5.0, huber_delta=1.0, huber_iters=3, return_betas=True):
+def _as_rows(rows, N, device):
+    """Normalise rows (None, index array/tensor or boolean mask) to a long index tensor."""
+    if rows is None:
+        return None
+    rows = torch.as_tensor(rows, device=device)
+    if rows.dtype == torch.bool:
+        if rows.shape != (N,):
+            raise ValueError(f"rows mask has shape {tuple(rows.shape)}, expected ({N},)")
+        return rows.nonzero().squeeze(1)
+    return rows.long().reshape(-1)
+
+def solve_local_wls(X, y, W, kind="ridge", ridge=5.0, huber_delta=1.0, huber_iters=3, return_betas=True,
+                    rows=None, huber_tol=1e-6):
+    """
+    W: dense (N, N) weights, a torch sparse (COO/CSR) matrix, or padded
+       neighbour lists (idx, w) of shape (N, k). Sparse inputs use the
+       neighbour engine and never touch the zero entries of W.
+    rows: optional index array or boolean mask of length N; only these rows'
+       local systems are solved, and y_hat / betas are returned for them
+       alone (in index order).
+    huber_tol: a row's IRLS stops once its coefficients move by at most
+       huber_tol (relative); None always runs huber_iters iterations.
+    """
+    rows = _as_rows(rows, X.shape[0], X.device)
+    if is_neighbors(W) or W.layout != torch.strided:
+        idx, w = as_neighbors(W)
+        if kind == "ridge":
+            return local_wls_ridge_sparse(X, y, idx, w, ridge=ridge, return_betas=return_betas, rows=rows)
+        elif kind == "huber":
+            return local_wls_huber_sparse(X, y, idx, w, ridge=ridge, delta=huber_delta, iters=huber_iters,
+                                          return_betas=return_betas, rows=rows, tol=huber_tol)
+        raise ValueError(f"Unknown WLS kind: {kind}")
     if kind == "ridge":
-        return local_wls_ridge(X, y, W, ridge=ridge, return_betas=return_betas)
+        return local_wls_ridge(X, y, W, ridge=ridge, return_betas=return_betas, rows=rows)
     elif kind == "huber":
-        return local_wls_huber(X, y, W, ridge=ridge, delta=huber_delta, iters=huber_iters, return_betas=return_betas)
+        return local_wls_huber(X, y, W, ridge=ridge, delta=huber_delta, iters=huber_iters,
+                               return_betas=return_betas, rows=rows, tol=huber_tol)
     else:
         raise ValueError(f"Unknown WLS kind: {kind}")